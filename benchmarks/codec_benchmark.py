@@ -0,0 +1,95 @@
+"""
+Encode/decode throughput of the queue and blob payload codecs.
+
+Compares the registered codecs against the record-dict JSON path that preceded
+them (`json.dumps(records, default=str)`) on a synthetic CDC batch with the
+column kinds SQL Server CDC produces. Run from the repository root:
+
+    python -m benchmarks.codec_benchmark --rows 100000 --repeat 5
+"""
+import argparse
+import datetime
+import decimal
+import json
+import time
+import uuid
+
+from utils.codec import CODECS
+from utils.columnar import ColumnarBatch
+
+COLUMNS = [
+    "__$start_lsn", "__$seqval", "__$operation", "id", "name", "price",
+    "ratio", "created_at", "updated_at", "birth_date", "row_guid", "notes",
+]
+
+def make_rows(count):
+    """Synthetic CDC rows covering binary, int, str, decimal, float, temporal and uuid columns, with NULLs."""
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    offset = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+    return [
+        (
+            i.to_bytes(10, "big"),
+            (i % 7).to_bytes(10, "big"),
+            2 + i % 3,
+            i,
+            f"customer-{i}",
+            decimal.Decimal(i) / 100,
+            i / 7,
+            base + datetime.timedelta(seconds=i, microseconds=i % 1000),
+            (base + datetime.timedelta(minutes=i)).replace(tzinfo=offset),
+            datetime.date(1970, 1, 1) + datetime.timedelta(days=i % 20000),
+            uuid.UUID(int=i),
+            None if i % 4 else f"note {i}",
+        )
+        for i in range(count)
+    ]
+
+def measure(func, repeat):
+    """Best wall-clock time of `repeat` calls, with the last result."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def legacy_records(batch):
+    return [
+        {"_source_table": batch.table, **dict(zip(batch.columns, row))}
+        for row in batch.rows()
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CDC payload codecs.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    batch = ColumnarBatch.from_rows("dbo.orders", COLUMNS, make_rows(args.rows))
+    records = legacy_records(batch)
+
+    results = [(
+        "records+json (legacy)",
+        measure(lambda: json.dumps(records, default=str).encode("utf-8"), args.repeat),
+        lambda payload: measure(lambda: json.loads(payload), args.repeat)[0],
+    )]
+    for name, codec in CODECS.items():
+        results.append((name, measure(lambda codec=codec: codec.encode(batch), args.repeat), None))
+
+    print(f"{args.rows} rows x {len(COLUMNS)} columns, best of {args.repeat}")
+    print(f"{'codec':<24}{'bytes':>12}{'encode rows/s':>16}{'decode rows/s':>16}  lossless")
+    for name, (encode_seconds, payload), decode in results:
+        if decode is None:
+            decode_seconds, decoded = measure(lambda name=name, payload=payload: CODECS[name].decode(payload), args.repeat)
+            lossless = decoded.data == batch.data
+        else:
+            decode_seconds = decode(payload)
+            lossless = False
+        print(
+            f"{name:<24}{len(payload):>12}{args.rows / encode_seconds:>16,.0f}"
+            f"{args.rows / decode_seconds:>16,.0f}  {'yes' if lossless else 'no'}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Offline throughput benchmark of the publisher and subscriber stages.
+
+SQL Server, Azure Blob Storage and Snowflake are replaced by local stand-ins:
+a synthetic pyodbc-style connection (utils.fakes.FakeSqlServerConnection), the
+filesystem blob store (utils.blob_store.LocalBlobStore) and a recording
+Snowflake connection (utils.fakes.FakeSnowflakeConnection). Each stage is
+timed on the same data and reported with rows/s, latency and the peak memory
+it allocated, traced with tracemalloc from the stage's start:
+
+    extract_cdc_changes -> serialize_data -> upload_to_blob -> download_and_process_blob
+
+Run from the repository root:
+
+    python -m benchmarks.pipeline_benchmark --rows 100000 --width 10 --output results.json
+    python -m benchmarks.pipeline_benchmark --baseline results.json --max-regression 0.2
+
+With --baseline the exit status is 1 if any stage's rows/s dropped by more
+than --max-regression, so the run can gate a deploy. Tracing slows allocation-heavy
+stages somewhat, so compare rows/s only against baselines from this benchmark.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def install_offline_modules(blob_dir):
+    """
+    Provide the config modules, and the pyodbc / snowflake.connector modules when
+    they are not installed, so the services import without live services. The
+    connections themselves are replaced with stand-ins after import.
+    """
+    def module(name, **attributes):
+        created = types.ModuleType(name)
+        created.__dict__.update(attributes)
+        sys.modules[name] = created
+        return created
+
+    try:
+        import config.db_config  # noqa: F401
+        import config.azure_storage  # noqa: F401
+    except ImportError:
+        module("config")
+        module("config.db_config", DB_CONFIG={"extract_concurrency": 1}, SNOWFLAKE_CONFIG={
+            "database": "BENCH", "schema": "PUBLIC", "session_keepalive_seconds": None,
+        })
+        module("config.azure_storage", AZURE_STORAGE_CONFIG={"local_path": blob_dir})
+
+    try:
+        import pyodbc  # noqa: F401
+    except ImportError:
+        module("pyodbc", connect=None)
+
+    try:
+        import snowflake.connector  # noqa: F401
+    except ImportError:
+        module("snowflake")
+        sys.modules["snowflake"].connector = module("snowflake.connector", connect=None)
+
+def timed(name, func, count_rows, count_batches):
+    """
+    Run one stage; rows and batches are counted from its result. Returns (result, stage report).
+    The traced peak is reset first, so the stage reports the most it held above what
+    earlier stages left allocated, not their peaks.
+    """
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    rows = count_rows(result)
+    return result, {
+        "stage": name,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds) if seconds else None,
+        "ms_per_batch": round(seconds * 1000 / max(count_batches(result), 1), 3),
+        "peak_mb": round((peak - baseline) / (1024 * 1024), 1),
+    }
+
+def run(args, workdir):
+    blob_dir = os.path.join(workdir, "blobs")
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+    os.chdir(workdir)  # Checkpoints, the local queue and logs are written relative to the working directory
+    sys.path.insert(0, REPO_ROOT)
+    install_offline_modules(blob_dir)
+
+    from services import publisher, subscriber
+    from utils.blob_store import LocalBlobStore
+    from utils.connection_pool import ConnectionPool
+    from utils.fakes import FakeSqlServerConnection, FakeSnowflakeConnection
+
+    tables = [f"dbo.bench_{i}" for i in range(args.tables)]
+    snowflake = FakeSnowflakeConnection()
+    store = LocalBlobStore(blob_dir)
+
+    publisher.sql_pool = ConnectionPool(
+        lambda: FakeSqlServerConnection(tables, args.rows, args.width, args.updates_per_key), name="Fake SQL Server"
+    )
+    subscriber.snowflake_pool = ConnectionPool(lambda: snowflake, max_size=1, name="Fake Snowflake")
+    publisher.get_batch_store = lambda: store
+    publisher.MAX_WINDOW_SECONDS = args.max_window_seconds
+    subscriber.get_blob_store = lambda config: store
+
+    reports = []
+    batches, report = timed(
+        "extract_cdc_changes", publisher.extract_cdc_changes,
+        lambda result: sum(len(batch) for batch in result), len
+    )
+    rows = report["rows"]
+    count = len(batches)
+    reports.append(report)
+
+    def serialize():
+        return sum(len(chunk) for batch in batches for chunk in publisher.serialize_data(batch))
+
+    size, report = timed("serialize_data", serialize, lambda _: rows, lambda _: count)
+    report["bytes"] = size
+    reports.append(report)
+
+    _, report = timed("upload_to_blob", lambda: publisher.upload_to_blob(batches), lambda _: rows, lambda _: count)
+    reports.append(report)
+
+    batches = None  # Let the loader run without the extracted batches held in memory
+    loaded, report = timed(
+        "download_and_process_blob", subscriber.download_and_process_blob,
+        lambda result: result, lambda _: len(store.list_prefixes("cdc/"))
+    )
+    report["snowflake_statements"] = len(snowflake.statements)
+    report["snowflake_rows"] = snowflake.loaded_rows
+    reports.append(report)
+
+    if loaded != rows:
+        print(f"warning: loaded {loaded} of {rows} extracted rows", file=sys.stderr)
+    return {"tables": args.tables, "rows_per_table": args.rows, "width": args.width, "stages": reports}
+
+def compare(results, baseline, max_regression):
+    """Return the stages whose rows/s fell more than `max_regression` below the baseline."""
+    previous = {stage["stage"]: stage for stage in baseline["stages"]}
+    regressions = []
+    for stage in results["stages"]:
+        before = previous.get(stage["stage"], {}).get("rows_per_second")
+        after = stage["rows_per_second"]
+        if before and after and after < before * (1 - max_regression):
+            regressions.append(f"{stage['stage']}: {after:,} rows/s vs {before:,} baseline")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CDC pipeline offline against local stand-ins.")
+    parser.add_argument("--tables", type=int, default=2, help="CDC-enabled tables to generate")
+    parser.add_argument("--rows", type=int, default=100000, help="Changes per table")
+    parser.add_argument("--width", type=int, default=10, help="Payload columns per table, besides CDC metadata and the key")
+    parser.add_argument("--updates-per-key", type=int, default=1, help="Changes per primary key, to exercise compaction")
+    parser.add_argument("--max-window-seconds", type=int, help="Cap each table's LSN window; the stand-in commits one change per second")
+    parser.add_argument("--workdir", help="Directory for checkpoints, blobs and logs (default: a temporary directory)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed rows/s drop per stage, as a fraction")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    tracemalloc.start()
+    try:
+        if args.workdir:
+            os.makedirs(args.workdir, exist_ok=True)
+            results = run(args, os.path.abspath(args.workdir))
+        else:
+            with tempfile.TemporaryDirectory(prefix="cdc_bench_") as workdir:
+                results = run(args, workdir)
+    finally:
+        tracemalloc.stop()
+
+    print(f"{args.tables} table(s) x {args.rows} rows x {args.width} payload columns")
+    print(f"{'stage':<28}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'ms/batch':>10}{'peak MB':>10}")
+    for stage in results["stages"]:
+        print(
+            f"{stage['stage']:<28}{stage['rows']:>10}{stage['seconds']:>10.3f}"
+            f"{stage['rows_per_second'] or 0:>12,}{stage['ms_per_batch']:>10.1f}{stage['peak_mb']:>10.1f}"
+        )
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
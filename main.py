@@ -1,4 +1,7 @@
+import argparse
 import multiprocessing
+import os
+import socket
 import subprocess
 
 def run_publisher():
@@ -7,12 +10,32 @@ def run_publisher():
 def run_subscriber():
     subprocess.run(["python", "-m", "services.subscriber"])
 
+def run_worker(worker_id, lease_store):
+    """Run one resident daemon that shares the CDC tables with the other workers through `lease_store`."""
+    subprocess.run(
+        ["python", "-m", "services.daemon", "--lease-store", lease_store, "--worker-id", worker_id],
+        env={**os.environ, "CDC_LOG_NAME": worker_id}  # One log file per worker
+    )
+
 if __name__ == "__main__":
-    p1 = multiprocessing.Process(target=run_publisher)
-    p2 = multiprocessing.Process(target=run_subscriber)
+    parser = argparse.ArgumentParser(description="Run the CDC publisher and subscriber.")
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="Start this many daemon workers that split the tables between them through leases"
+    )
+    parser.add_argument("--lease-store", default="leases/leases.db", help="Lease database shared by the workers")
+    args = parser.parse_args()
+
+    if args.workers:
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(f"{socket.gethostname()}-worker-{i}", args.lease_store))
+            for i in range(args.workers)
+        ]
+    else:
+        processes = [multiprocessing.Process(target=run_publisher), multiprocessing.Process(target=run_subscriber)]
 
-    p1.start()
-    p2.start()
+    for process in processes:
+        process.start()
 
-    p1.join()
-    p2.join()
\ No newline at end of file
+    for process in processes:
+        process.join()
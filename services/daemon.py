@@ -0,0 +1,146 @@
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from functools import partial
+
+from utils.logger import log_info, log_error
+
+class AdaptiveStage:
+    """
+    Runs one pipeline stage in a loop on its own thread, so runs of the same
+    stage can never overlap. After a run that found work the stage polls
+    again after `min_interval`; when a run reports a backlog it polls again
+    immediately; idle runs back off exponentially up to `max_interval`.
+    """
+
+    def __init__(self, name, run_once, min_interval=1.0, max_interval=30.0, backoff=2.0):
+        self.name = name
+        self.run_once = run_once
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def next_interval(self, rows, backlog):
+        """Pick the delay before the next run from the outcome of the last one."""
+        if backlog:
+            return 0
+        if rows:
+            return self.min_interval
+        return min(max(self.interval, self.min_interval) * self.backoff, self.max_interval)
+
+    def run(self, stop):
+        while not stop.is_set():
+            started = time.monotonic()
+            rows, backlog = 0, False
+            try:
+                result = self.run_once()
+                rows, backlog = result if isinstance(result, tuple) else (result or 0, False)
+            except Exception as e:
+                log_error(f"{self.name} run failed: {e}")
+
+            self.interval = self.next_interval(rows, backlog)
+            message = (
+                f"{self.name} run processed {rows} records in {time.monotonic() - started:.2f}s; "
+                f"next run in {self.interval:.1f}s"
+            )
+            if rows:
+                log_info(message)
+            else:
+                log_info(message, max_per_minute=2)  # Idle polls
+            stop.wait(self.interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the CDC publisher and subscriber as one resident process.")
+    parser.add_argument(
+        "--stages", default="publisher,subscriber",
+        help="Comma-separated stages to run: publisher, subscriber, or pipeline (extract to load in one asyncio pass)"
+    )
+    parser.add_argument("--min-interval", type=float, default=1.0, help="Seconds between runs that found work")
+    parser.add_argument("--max-interval", type=float, default=30.0, help="Upper bound for idle back-off, in seconds")
+    parser.add_argument("--backoff", type=float, default=2.0, help="Idle back-off multiplier")
+    parser.add_argument(
+        "--metrics-port", type=int,
+        help="Serve Prometheus metrics on /metrics and a JSON snapshot on /metrics.json at this local port"
+    )
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Interface the metrics endpoint binds to")
+    parser.add_argument(
+        "--lease-store",
+        help="Lease database shared by the workers of a scale-out group; each stage then handles only the tables it leases"
+    )
+    parser.add_argument("--worker-id", help="Unique worker name in the group (default: <host>-<pid>)")
+    parser.add_argument("--lease-ttl", type=float, default=30.0, help="Seconds before a silent worker's tables fail over")
+    args = parser.parse_args()
+
+    metrics_server = None
+    if args.metrics_port is not None:
+        from utils.metrics import start_metrics_server
+        metrics_server = start_metrics_server(args.metrics_port, args.metrics_host)
+
+    leases = []
+    lease_store = None
+    if args.lease_store:
+        from utils.leases import TableLeases, get_lease_store
+        lease_store = get_lease_store(args.lease_store)
+        worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+
+    def leased(group, run_once):
+        """Limit a stage's runs to the tables its worker group assigns to this worker."""
+        if lease_store is None:
+            return run_once
+        table_leases = TableLeases(lease_store, group, worker_id, args.lease_ttl).start()
+        leases.append(table_leases)
+        return partial(run_once, select_tables=table_leases.claim)
+
+    stages = []
+    names = [name.strip() for name in args.stages.split(",") if name.strip()]
+    if "publisher" in names:
+        from services import publisher
+        stages.append(AdaptiveStage(
+            "Publisher", leased("publisher", publisher.run_once), args.min_interval, args.max_interval, args.backoff
+        ))
+    if "subscriber" in names:
+        from services import subscriber
+        stages.append(AdaptiveStage(
+            "Subscriber", leased("subscriber", subscriber.run_once), args.min_interval, args.max_interval, args.backoff
+        ))
+    if "pipeline" in names:
+        from services import pipeline, publisher, subscriber
+        stages.append(AdaptiveStage(
+            "Pipeline", leased("pipeline", pipeline.run_once), args.min_interval, args.max_interval, args.backoff
+        ))
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    threads = [threading.Thread(target=stage.run, args=(stop,), name=stage.name) for stage in stages]
+    for thread in threads:
+        thread.start()
+    log_info(
+        f"CDC daemon started with stages: {[stage.name for stage in stages]}"
+        + (f" as worker {worker_id} of lease store {args.lease_store}" if lease_store else "")
+    )
+
+    while not stop.is_set():
+        stop.wait(1)
+
+    log_info("CDC daemon stopping; waiting for in-flight runs to finish...")
+    for thread in threads:
+        thread.join()
+    for table_leases in leases:
+        table_leases.stop()  # Hand the tables to the remaining workers without waiting for expiry
+
+    if "publisher" in names or "pipeline" in names:
+        publisher.sql_pool.close_all()
+    if "subscriber" in names or "pipeline" in names:
+        subscriber.snowflake_pool.close_all()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    log_info("CDC daemon stopped")
+
+if __name__ == "__main__":
+    main()
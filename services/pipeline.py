@@ -0,0 +1,218 @@
+import asyncio
+import time
+
+from services import publisher, subscriber
+from utils.blob_store import BlobExistsError, encode_batch, table_prefix, upload_encoded
+from utils.logger import log_info, log_error
+from utils.metrics import ROWS_PUBLISHED, STAGE_SECONDS
+
+# Batches that may wait between two stages; a full channel blocks the stage feeding it
+CHANNEL_SIZE = 4
+DONE = object()
+
+# Set when a load failed, so the next run first replays the durable blob batches; it starts set so a
+# restarted process replays what an earlier one left behind, and is cleared only by a complete replay
+_needs_catch_up = True
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the default thread pool without stalling the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+def timed(stage, func):
+    """Wrap a blocking stage call so its duration is recorded under `stage`."""
+    def call(*args):
+        with STAGE_SECONDS.time(stage=stage):
+            return func(*args)
+    return call
+
+async def extract_stage(batches, out):
+    """Pull batches from the blocking extraction generator, one at a time, only when `out` has room."""
+    while True:
+        batch = await run_blocking(next, batches, DONE)
+        if batch is DONE:
+            break
+        await out.put(batch)
+    await out.put(DONE)
+
+async def encode_stage(inp, out, failed):
+    """Serialize and compress each batch off the event loop; a table that fails is added to `failed` and skipped."""
+    while True:
+        batch = await inp.get()
+        if batch is DONE:
+            break
+        if batch.table in failed:
+            continue
+        try:
+            encoded = await run_blocking(
+                timed("encode", encode_batch), batch, publisher.BLOB_COMPRESSION, publisher.BLOB_PAYLOAD_CODEC
+            )
+        except Exception as e:
+            log_error(f"Pipeline encode failed for {batch.table}: {e}; its window is extracted again next poll")
+            failed.add(batch.table)
+            continue
+        await out.put((batch, encoded))
+    await out.put(DONE)
+
+async def upload_stage(inp, out, failed):
+    """
+    Upload each encoded batch as an immutable blob object before it is loaded. A table whose
+    upload fails is added to `failed` and its later batches are dropped, so nothing after the
+    gap is loaded and its window is extracted again next poll; other tables carry on.
+    """
+    while True:
+        item = await inp.get()
+        if item is DONE:
+            break
+        batch, (name, blocks, metadata) = item
+        if batch.table in failed:
+            continue
+        if publisher.snapshot_in_progress(batch.table):
+            continue  # Its snapshot started during the poll and supersedes these changes
+        try:
+            await run_blocking(
+                timed("upload_blob", upload_encoded),
+                publisher.get_batch_store(), name, blocks, metadata, publisher.BLOB_UPLOAD_CONCURRENCY
+            )
+        except BlobExistsError:
+            pass  # Uploaded by an earlier run that failed before checkpointing this window
+        except Exception as e:
+            log_error(f"Pipeline upload failed for {batch.table}: {e}; its window is extracted again next poll")
+            failed.add(batch.table)
+            continue
+        ROWS_PUBLISHED.inc(len(batch), table=batch.table)
+        await out.put((batch, name))
+    await out.put(DONE)
+
+def follows_watermark(table, name, previous):
+    """
+    Return True if batch object `name` comes directly after the table's blob watermark, i.e. no
+    earlier object is still unloaded. `previous` is the object this run last loaded for the table;
+    while the watermark still points at it, the pipeline's own upload order guarantees the rest.
+    """
+    watermark = subscriber.get_blob_watermark(table)
+    if previous is not None and watermark == previous:
+        return True
+    return publisher.get_batch_store().list(table_prefix(table), start_after=watermark)[:1] == [name]
+
+def catch_up_table(table, failed):
+    """Load a table's unloaded batch objects in order from blob storage; returns (records loaded, new watermark)."""
+    _, records = subscriber.load_blob_table(publisher.get_batch_store(), table, failed)
+    return records, subscriber.get_blob_watermark(table)
+
+async def load_stage(inp, stats):
+    """
+    Load each batch into Snowflake and advance the table's blob watermark.
+    A batch is loaded directly only if it follows the watermark; otherwise the table's
+    unloaded objects, this one included, are first replayed from blob storage in order.
+    After a failure the table's remaining batches are skipped for the rest of the run,
+    so no later change is applied ahead of an earlier one.
+    """
+    global _needs_catch_up
+    failed_tables = set()
+    last_loaded = {}  # table -> batch object this run last loaded
+
+    while True:
+        item = await inp.get()
+        if item is DONE:
+            break
+        batch, name = item
+        table = batch.table
+        if table in failed_tables:
+            continue
+
+        try:
+            watermark = subscriber.get_blob_watermark(table)
+            if watermark is not None and name <= watermark:
+                # Already loaded, by a replay or before its window was extracted again
+                await run_blocking(subscriber.archive_loaded, publisher.get_batch_store(), [name])
+                continue
+            if not await run_blocking(follows_watermark, table, name, last_loaded.get(table)):
+                log_info(f"Replaying unloaded batch objects of {table} before {name}")
+                records, last_loaded[table] = await run_blocking(catch_up_table, table, failed_tables)
+                stats["rows"] += records
+                if table in failed_tables:
+                    _needs_catch_up = True
+                continue
+
+            await run_blocking(subscriber.load_table_batch, table.replace(".", "_"), batch)
+            subscriber.save_blob_watermark(table, name)
+            await run_blocking(subscriber.archive_loaded, publisher.get_batch_store(), [name])
+            last_loaded[table] = name
+            stats["rows"] += len(batch)
+        except Exception as e:
+            log_error(f"Pipeline load failed for {table}: {e}; its remaining batches are left for the blob replay")
+            failed_tables.add(table)
+            _needs_catch_up = True
+
+async def run_pipeline(channel_size=CHANNEL_SIZE, select_tables=None):
+    """
+    Run one poll through overlapping extract -> encode -> upload -> load stages.
+    Stages are connected by bounded channels, so batch N+1 is extracted while
+    batch N is loading and a slow sink pushes back on extraction instead of
+    growing memory. LSN checkpoints are saved only after every batch is uploaded;
+    a table whose encode or upload failed keeps its checkpoint, so only its window is
+    extracted again. Returns (records loaded, whether a window was capped).
+    """
+    backlog = set()
+    windows = {}  # table -> upper LSN of its extracted window, saved once every batch is uploaded
+    if publisher.EXTRACT_CONCURRENCY > 1:
+        batches = publisher.iter_cdc_changes_parallel(backlog=backlog, select_tables=select_tables, checkpoint=windows.__setitem__)
+    else:
+        batches = publisher.iter_cdc_changes(backlog=backlog, select_tables=select_tables, checkpoint=windows.__setitem__)
+
+    extracted = asyncio.Queue(maxsize=channel_size)
+    encoded = asyncio.Queue(maxsize=channel_size)
+    uploaded = asyncio.Queue(maxsize=channel_size)
+    stats = {"rows": 0}
+    failed = set()  # Tables with a batch that could not be encoded or uploaded
+
+    tasks = [
+        asyncio.ensure_future(extract_stage(batches, extracted)),
+        asyncio.ensure_future(encode_stage(extracted, encoded, failed)),
+        asyncio.ensure_future(upload_stage(encoded, uploaded, failed)),
+        asyncio.ensure_future(load_stage(uploaded, stats)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        try:
+            batches.close()
+        except ValueError:
+            pass  # Still running on a worker thread; it finishes on its own
+
+    for table in failed:
+        windows.pop(table, None)
+    for table, lsn in windows.items():
+        if not publisher.snapshot_in_progress(table):
+            publisher.save_last_processed_lsn(table, lsn)
+    return stats["rows"], bool(backlog)
+
+def run_once(select_tables=None):
+    """
+    Run one pipelined poll, first replaying blob batches left behind by a failed load.
+    `select_tables` limits the poll to this worker's tables.
+    """
+    global _needs_catch_up
+    if _needs_catch_up:
+        failed = set()
+        subscriber.download_and_process_blob(select_tables, failed)
+        _needs_catch_up = bool(failed)
+
+    started = time.monotonic()
+    rows, backlog = asyncio.run(run_pipeline(select_tables=select_tables))
+    log_info(f"Pipeline run loaded {rows} records in {time.monotonic() - started:.2f}s")
+    return rows, backlog
+
+def main():
+    """Main execution function."""
+    try:
+        run_once()
+    except Exception as e:
+        log_error(f"Error in pipeline: {str(e)}")
+
+if __name__ == "__main__":
+    main()
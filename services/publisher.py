@@ -1,21 +1,96 @@
 import pyodbc
+import datetime
 import json
 import os
-from azure.storage.blob import BlobServiceClient
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from config.azure_storage import AZURE_STORAGE_CONFIG
-from utils.queue_handler import publish_to_queue
 from utils.logger import log_info, log_error
-import datetime
+from utils.connection_pool import ConnectionPool
+from utils.blob_store import get_blob_store, put_batch, iter_payload
+from utils.columnar import ColumnarBatch
+from utils.sinks import BlobSink, QueueSink, SinkError, SinkFanout, SpoolSink, get_sink, register_sink
+from utils.source_catalog import SourceCatalog
+from utils.metrics import ROWS_EXTRACTED, ROWS_PUBLISHED, STAGE_SECONDS
 from config.db_config import DB_CONFIG
 
-def get_cdc_enabled_tables():
-    """Fetch all CDC-enabled tables dynamically from SQL Server."""
+# Compression for batch objects: "gzip" or "zstd" (requires zstandard)
+BLOB_COMPRESSION = AZURE_STORAGE_CONFIG.get("compression", "gzip")
+# Payload codec for batch objects: "json" (NDJSON) or "binary" (type-preserving frames)
+BLOB_PAYLOAD_CODEC = AZURE_STORAGE_CONFIG.get("payload_codec", "json")
+# Blocks staged concurrently per batch object upload
+BLOB_UPLOAD_CONCURRENCY = AZURE_STORAGE_CONFIG.get("max_concurrency", 4)
+# Maximum number of CDC rows held in memory at once; the cursor is drained with fetchmany
+FETCH_BATCH_SIZE = DB_CONFIG.get("fetch_batch_size", 5000)
+# Optional cap on the commit-time span covered by one table's LSN window per poll
+MAX_WINDOW_SECONDS = DB_CONFIG.get("max_window_seconds")
+# Read cdc.fn_cdc_get_net_changes_* (final state per key) instead of every change
+NET_CHANGES = DB_CONFIG.get("net_changes", False)
+# Number of tables extracted concurrently; 1 keeps the sequential single-connection path
+EXTRACT_CONCURRENCY = DB_CONFIG.get("extract_concurrency", 4)
+# Collapse each primary key's changes within a batch to its final state before publishing; applies only
+# to batches that carry their key, which the subscriber merges on, so dropped versions are superseded
+COMPACT_CHANGES = DB_CONFIG.get("compact_changes", True)
+# Minimum seconds between checks of cdc.change_tables / cdc.ddl_history for catalog changes
+CATALOG_CHECK_SECONDS = DB_CONFIG.get("catalog_check_seconds", 30)
+# Sinks every extracted batch is written to, concurrently; a table's LSN checkpoint advances only once all have it
+PUBLISH_SINKS = DB_CONFIG.get("publish_sinks", ["queue", "blob"])
+# Local directory of the "spool" sink's batch objects
+SPOOL_DIR = DB_CONFIG.get("spool_dir", "spool")
+
+# Source commit time (UTC) of each change, joined from cdc.lsn_time_mapping and moved into batch metadata
+COMMIT_TIME = "__$commit_time"
+
+# ODBC type code of datetimeoffset, which pyodbc otherwise returns as raw bytes
+SQL_SS_TIMESTAMPOFFSET = -155
+
+# Source primary key columns per table, discovered once per process
+primary_keys = {}
+# Capture instances, captured columns and exact source types, reloaded only on CDC/DDL changes
+source_catalog = SourceCatalog(CATALOG_CHECK_SECONDS)
+
+def datetimeoffset_to_datetime(value):
+    """Convert a raw SQL Server datetimeoffset value into a timezone-aware datetime."""
+    year, month, day, hour, minute, second, nanoseconds, offset_hours, offset_minutes = struct.unpack("<6hI2h", value)
+    return datetime.datetime(
+        year, month, day, hour, minute, second, nanoseconds // 1000,
+        datetime.timezone(datetime.timedelta(hours=offset_hours, minutes=offset_minutes))
+    )
+
+def connect_sql_server():
+    """Open a new connection to the source SQL Server."""
+    conn = pyodbc.connect(
+        f"DRIVER={{SQL Server}};SERVER={DB_CONFIG['server']};DATABASE={DB_CONFIG['database']};UID={DB_CONFIG['username']};PWD={DB_CONFIG['password']}"
+    )
+    conn.add_output_converter(SQL_SS_TIMESTAMPOFFSET, datetimeoffset_to_datetime)
+    return conn
+
+# One extra connection for the poll-level metadata queries
+sql_pool = ConnectionPool(connect_sql_server, max_size=EXTRACT_CONCURRENCY + 1, name="SQL Server")
+
+def get_cdc_enabled_tables(cursor=None):
+    """Fetch all CDC-enabled tables from the source catalog, falling back to sys.tables."""
+    if cursor is None:
+        with sql_pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                return get_cdc_enabled_tables(cursor)
+            finally:
+                cursor.close()
+
+    try:
+        source_catalog.refresh(cursor)
+        tables = source_catalog.tables()
+        log_info(f"Detected CDC-enabled tables: {tables}", max_per_minute=1)
+        return tables
+    except Exception as e:
+        log_error(f"Source catalog unavailable ({e}); listing CDC tables from sys.tables", max_per_minute=1)
+
     try:
-        conn = pyodbc.connect(
-            f"DRIVER={{SQL Server}};SERVER={DB_CONFIG['server']};DATABASE={DB_CONFIG['database']};UID={DB_CONFIG['username']};PWD={DB_CONFIG['password']}"
-        )
-        cursor = conn.cursor()
-        
         query = """
         SELECT s.name + '.' + t.name AS table_name
         FROM sys.tables t
@@ -26,15 +101,12 @@ def get_cdc_enabled_tables():
         cursor.execute(query)
         tables = [row[0] for row in cursor.fetchall()]
         
-        log_info(f"Detected CDC-enabled tables: {tables}")
+        log_info(f"Detected CDC-enabled tables: {tables}", max_per_minute=1)
         return tables
 
     except Exception as e:
         log_error(f"Error fetching CDC tables: {str(e)}")
         return []
-    finally:
-        cursor.close()
-        conn.close()
 
 def get_last_processed_lsn(table_name):
     """Retrieve the last processed LSN for each table."""
@@ -51,122 +123,363 @@ def save_last_processed_lsn(table_name, lsn):
     with open(file_name, "w") as f:
         f.write(lsn)
 
-def extract_cdc_changes():
-    """Extract CDC changes from all CDC-enabled tables."""
-    all_changes = []
-    
-    try:
-        conn = pyodbc.connect(
-            f"DRIVER={{SQL Server}};SERVER={DB_CONFIG['server']};DATABASE={DB_CONFIG['database']};UID={DB_CONFIG['username']};PWD={DB_CONFIG['password']}"
+def snapshot_state_file(table_name):
+    """State of a table's unfinished snapshot (see services.snapshot); the table is not polled while it exists."""
+    return f"snapshot_{table_name.replace('.', '_')}.json"
+
+def snapshot_in_progress(table):
+    return os.path.exists(snapshot_state_file(table))
+
+def rows_to_batch(table, columns, rows, metadata=None):
+    """
+    Transpose raw cursor rows into a ColumnarBatch for one table.
+    The newest source commit time in the batch is kept as metadata["commit_time"]
+    so the subscriber can measure end-to-end replication lag.
+    """
+    batch = ColumnarBatch.from_rows(table, columns, rows, metadata)
+    if COMMIT_TIME not in batch.columns:
+        return batch
+    commit_times = [value for value in batch.column(COMMIT_TIME) if value is not None]
+    if commit_times:
+        batch.metadata["commit_time"] = max(commit_times).isoformat()
+    return batch.drop({COMMIT_TIME})
+
+def lsn_to_hex(lsn):
+    """Format a binary(10) LSN the way it is stored in the checkpoint files."""
+    return f"0x{lsn.hex().upper()}"
+
+def hex_to_lsn(value):
+    """Parse a checkpointed '0x...' LSN back into bytes for use as a query parameter."""
+    return bytes.fromhex(value[2:] if value.lower().startswith("0x") else value)
+
+def get_capture_instance(table):
+    """Return a table's newest CDC capture instance from the source catalog, or SQL Server's default name."""
+    entry = source_catalog.get(table)
+    return entry["capture_instance"] if entry else table.replace('.', '_')
+
+def get_source_metadata(table):
+    """Batch metadata with the table's exact source column types and their catalog version."""
+    entry = source_catalog.get(table)
+    if entry is None:
+        return None
+    return {"source_types": entry["columns"], "schema_version": entry["version"]}
+
+def get_max_lsn(cursor):
+    """Read the highest LSN available to CDC; called once per poll as the shared upper bound."""
+    cursor.execute("SELECT sys.fn_cdc_get_max_lsn()")
+    return cursor.fetchone()[0]
+
+def get_lsn_window(cursor, table, max_lsn):
+    """
+    Compute the [from, to] LSN window to read for a table in this poll.
+    Returns None when there is nothing new to read.
+    """
+    capture_instance = get_capture_instance(table)
+
+    cursor.execute("SELECT sys.fn_cdc_get_min_lsn(?)", capture_instance)
+    min_lsn = cursor.fetchone()[0]
+    if not min_lsn or not any(min_lsn):
+        log_error(f"No valid CDC capture instance '{capture_instance}' for {table}")
+        return None
+
+    last_lsn = get_last_processed_lsn(table)
+    if last_lsn:
+        cursor.execute("SELECT sys.fn_cdc_increment_lsn(?)", hex_to_lsn(last_lsn))
+        from_lsn = cursor.fetchone()[0]
+        if from_lsn < min_lsn:
+            log_error(f"Changes for {table} after {last_lsn} were purged by CDC cleanup; resuming at {lsn_to_hex(min_lsn)}")
+            from_lsn = min_lsn
+    else:
+        from_lsn = min_lsn  # First-time execution
+
+    to_lsn = max_lsn
+    if MAX_WINDOW_SECONDS:
+        # from_lsn is usually an incremented LSN rather than a transaction's start_lsn, so the window
+        # starts at the commit time of the first transaction at or after it
+        cursor.execute(
+            "SELECT sys.fn_cdc_map_time_to_lsn('largest less than or equal', DATEADD(SECOND, ?, "
+            "(SELECT MIN(tran_end_time) FROM cdc.lsn_time_mapping WHERE start_lsn >= ?)))",
+            MAX_WINDOW_SECONDS, from_lsn
         )
-        cursor = conn.cursor()
-        
-        cdc_tables = get_cdc_enabled_tables()
-        
-        for table in cdc_tables:
-            cdc_table_name = f"cdc.{table.replace('.', '_')}_CT"
-            last_lsn = get_last_processed_lsn(table)
-
-            query = f"SELECT * FROM {cdc_table_name}"
-            if last_lsn:
-                query += f" WHERE __$start_lsn > CONVERT(VARBINARY, '{last_lsn}', 1)"
-
-            log_info(f"Executing CDC query for {table}...")
-            cursor.execute(query)
-            
-            columns = [column[0] for column in cursor.description]
-            changes = cursor.fetchall()
-
-            if not changes:
-                log_info(f"No new CDC changes found for {table}.")
-                continue
-
-            data = [
-                {
-                    "_source_table": table,
-                    **{
-                        columns[i]: (f"0x{row[i].hex().upper()}" if isinstance(row[i], bytes) else row[i])
-                        for i in range(len(columns))
-                    }
-                }
-                for row in changes
-            ]
-
-            if data:
-                log_info(f"Sample CDC record for {table}: {json.dumps(data[0], default=str, indent=2)}")
-                save_last_processed_lsn(table, data[-1]["__$start_lsn"])  # Save last LSN
-            
-            all_changes.extend(data)
+        capped_lsn = cursor.fetchone()[0]
+        if capped_lsn and from_lsn <= capped_lsn < to_lsn:
+            to_lsn = capped_lsn
 
-    except Exception as e:
-        log_error(f"CDC extraction error: {str(e)}")
+    if from_lsn > to_lsn:
         return None
-    finally:
-        cursor.close()
-        conn.close()
+    return from_lsn, to_lsn
 
-    return all_changes
+def get_primary_key(cursor, table):
+    """Return a table's primary key columns in key order from sys.indexes; empty if it has none."""
+    if table not in primary_keys:
+        cursor.execute("""
+        SELECT c.name
+        FROM sys.indexes i
+        INNER JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        INNER JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(?) AND i.is_primary_key = 1
+        ORDER BY ic.key_ordinal
+        """, table)
+        primary_keys[table] = [row[0] for row in cursor.fetchall()]
+        if not primary_keys[table]:
+            log_info(f"{table} has no primary key; its changes are published without compaction and only inserted")
+    return primary_keys[table]
 
-def serialize_data(data):
-    """Serialize CDC data for storage and queue processing."""
+def get_changes_query(table):
+    """
+    Build the parameterized CDC table-valued function query for a table's capture instance.
+    Each change carries its transaction's commit time in UTC, read from cdc.lsn_time_mapping
+    (the table behind sys.fn_cdc_map_lsn_to_time) with one join instead of a function call per row.
+    """
+    capture_instance = get_capture_instance(table)
+    if NET_CHANGES:
+        function, order_by = "fn_cdc_get_net_changes", "c.__$start_lsn"
+    else:
+        function, order_by = "fn_cdc_get_all_changes", "c.__$start_lsn, c.__$seqval"
+    return f"""
+    SELECT c.*, DATEADD(MINUTE, DATEDIFF(MINUTE, GETDATE(), GETUTCDATE()), m.tran_end_time) AS [{COMMIT_TIME}]
+    FROM cdc.{function}_{capture_instance}(?, ?, N'all') c
+    LEFT JOIN cdc.lsn_time_mapping m ON m.start_lsn = c.__$start_lsn
+    ORDER BY {order_by}
+    """
+
+def iter_table_changes(cursor, table, max_lsn, batch_size=FETCH_BATCH_SIZE, backlog=None, checkpoint=None):
+    """
+    Yield CDC changes for one table's [from, to] LSN window as ColumnarBatch
+    chunks of at most `batch_size` rows. The query text is fixed per capture instance so pyodbc
+    reuses the prepared statement. With COMPACT_CHANGES, each chunk is collapsed
+    to the final change per primary key. After the last batch has been consumed, the
+    window's upper LSN is saved, or handed to `checkpoint(table, lsn)` for the caller
+    to save once the batches are safely published. Tables whose window was capped below
+    `max_lsn` are added to the `backlog` set.
+    """
+    window = get_lsn_window(cursor, table, max_lsn)
+    if not window:
+        log_info(f"No new CDC changes found for {table}.", max_per_minute=6)
+        return
+
+    from_lsn, to_lsn = window
+    key_columns = get_primary_key(cursor, table)
+    log_info(f"Executing CDC query for {table} [{lsn_to_hex(from_lsn)}, {lsn_to_hex(to_lsn)}]...")
+    cursor.execute(get_changes_query(table), from_lsn, to_lsn)
+
+    columns = [column[0] for column in cursor.description]
+    if not all(col in columns for col in key_columns):
+        log_info(f"{table}'s capture instance does not include its primary key; its changes are published without compaction and only inserted", max_per_minute=1)
+        key_columns = []
+    metadata = get_source_metadata(table)
+    if key_columns:
+        metadata = {**(metadata or {}), "primary_key": key_columns}  # The subscriber merges on it
+    total = 0
+    published = 0
+    chunk = 0
+
+    while True:
+        started = time.perf_counter()
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+
+        ROWS_EXTRACTED.inc(len(rows), table=table)
+        # The chunk's position in the window keeps batch object names ordered and repeatable
+        data = rows_to_batch(table, columns, rows, {**(metadata or {}), "window_chunk": chunk})
+        chunk += 1
+        if not total:
+            sample = data
+            log_info(
+                lambda: f"Sample CDC record for {table}: {json.dumps(dict(zip(sample.columns, next(sample.rows()))), default=str)}",
+                max_per_minute=1
+            )
+
+        total += len(data)
+        if COMPACT_CHANGES and key_columns:
+            data = data.compact(key_columns)
+            if not len(data):
+                continue  # Only update before-images
+        published += len(data)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="extract")
+        yield data
+
+    if total:
+        log_info(f"Extracted {total} CDC changes for {table}" + (f", compacted to {published}" if published < total else ""))
+    else:
+        log_info(f"No new CDC changes found for {table}.", max_per_minute=6)
+    (checkpoint or save_last_processed_lsn)(table, lsn_to_hex(to_lsn))
+    if backlog is not None and to_lsn < max_lsn:
+        backlog.add(table)
+
+def select_cdc_tables(tables, select_tables=None):
+    """
+    Skip tables with a snapshot in progress, then narrow the rest to those this
+    worker owns (`select_tables`, e.g. TableLeases.claim in multi-worker mode).
+    """
+    tables = [table for table in tables if not snapshot_in_progress(table)]
+    return tables if select_tables is None else select_tables(tables)
+
+def iter_cdc_changes(batch_size=FETCH_BATCH_SIZE, backlog=None, select_tables=None, checkpoint=None):
+    """Yield CDC changes from CDC-enabled tables (all, or those `select_tables` keeps) as bounded per-table ColumnarBatch chunks."""
     try:
-        if isinstance(data, list):
-            serialized = [
-                {
-                    "_source_table": row["_source_table"],  # Correctly reference '_source_table'
-                    **{
-                        k: (v.isoformat() if isinstance(v, datetime.datetime) else v)
-                        for k, v in row.items() if k != "_source_table"  # Exclude '_source_table' from nested serialization
-                    }
-                }
-                for row in data
-            ]
-            log_info(f"Successfully serialized {len(serialized)} records")
-            return serialized
+        with sql_pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                max_lsn = get_max_lsn(cursor)
+                if not max_lsn:
+                    log_error("CDC is not enabled on the source database or has no changes yet")
+                    return
+
+                for table in select_cdc_tables(get_cdc_enabled_tables(cursor), select_tables):
+                    yield from iter_table_changes(cursor, table, max_lsn, batch_size, backlog, checkpoint)
+            finally:
+                cursor.close()
+
     except Exception as e:
-        log_error(f"Serialization error: {str(e)}")
-    
-    return data
+        log_error(f"CDC extraction error: {str(e)}")
 
-def upload_to_blob(data):
-    """Upload CDC changes to Azure Blob Storage."""
+def iter_cdc_changes_parallel(
+    max_workers=EXTRACT_CONCURRENCY, batch_size=FETCH_BATCH_SIZE, backlog=None, select_tables=None, checkpoint=None
+):
+    """
+    Extract CDC-enabled tables concurrently on pooled connections and yield each
+    batch as soon as any table produces it. At most `max_workers` tables are read
+    at once and the hand-off queue is bounded, so memory stays proportional to the
+    batch size. A failing table is logged and skipped without affecting the others.
+    """
     try:
-        file_path = "cdc_changes.json"
-        serialized_data = serialize_data(data)
+        with sql_pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                max_lsn = get_max_lsn(cursor)
+                tables = select_cdc_tables(get_cdc_enabled_tables(cursor), select_tables) if max_lsn else []
+            finally:
+                cursor.close()
+    except Exception as e:
+        log_error(f"CDC extraction error: {str(e)}")
+        return
 
-        log_info(f"Writing {len(serialized_data)} records to {file_path}")
+    if not max_lsn:
+        log_error("CDC is not enabled on the source database or has no changes yet")
+        return
 
-        with open(file_path, "w") as f:
-            json.dump(serialized_data, f, indent=2)
-            log_info(f"JSON file created successfully: {os.path.getsize(file_path)} bytes")
+    ready = queue.Queue(maxsize=max_workers * 2)
+    stop = threading.Event()
+    done = object()
 
-        blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONFIG["connection_string"])
-        blob_client = blob_service_client.get_blob_client(container=AZURE_STORAGE_CONFIG["container_name"], blob=file_path)
+    def extract_table(table):
+        try:
+            with sql_pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    for batch in iter_table_changes(cursor, table, max_lsn, batch_size, backlog, checkpoint):
+                        if stop.is_set():
+                            break
+                        ready.put(batch)
+                finally:
+                    cursor.close()
+        except Exception as e:
+            log_error(f"CDC extraction error for {table}: {str(e)}")
+        finally:
+            ready.put(done)
 
-        with open(file_path, "rb") as f:
-            blob_client.upload_blob(f, overwrite=True)
+    pending = len(tables)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cdc-extract") as executor:
+        for table in tables:
+            executor.submit(extract_table, table)
 
-        log_info(" CDC Changes uploaded to Azure Blob successfully")
+        try:
+            while pending:
+                item = ready.get()
+                if item is done:
+                    pending -= 1
+                else:
+                    yield item
+        finally:
+            # Unblock workers if the consumer stopped early
+            stop.set()
+            while pending:
+                if ready.get() is done:
+                    pending -= 1
 
-        downloaded_content = blob_client.download_blob().readall()
-        log_info(f"Verified blob size: {len(downloaded_content)} bytes")
+def extract_cdc_changes():
+    """Extract CDC changes from all CDC-enabled tables into a list of per-table ColumnarBatch chunks."""
+    return list(iter_cdc_changes())
+
+def serialize_data(data):
+    """Serialize a ColumnarBatch for storage with the configured payload codec, as a stream of bytes."""
+    return iter_payload(data, BLOB_PAYLOAD_CODEC)
 
-        os.remove(file_path)
-        log_info(f"Cleaned up local file: {file_path}")
+@lru_cache(maxsize=None)
+def get_batch_store():
+    """Return the shared batch object store (Azure, or a local directory when configured)."""
+    return get_blob_store(AZURE_STORAGE_CONFIG)
+
+def upload_to_blob(data):
+    """Upload a ColumnarBatch (or a list of them) to Azure Blob Storage as one immutable object per batch."""
+    try:
+        for batch in (data if isinstance(data, list) else [data]):
+            if len(batch):
+                put_batch(get_batch_store(), batch, BLOB_COMPRESSION, BLOB_UPLOAD_CONCURRENCY, BLOB_PAYLOAD_CODEC)
+        return True
 
     except Exception as e:
         log_error(f"Azure Blob upload error: {str(e)}")
+        return False
+
+register_sink("queue", QueueSink)
+register_sink("blob", lambda: BlobSink(get_batch_store(), BLOB_COMPRESSION, BLOB_UPLOAD_CONCURRENCY, BLOB_PAYLOAD_CODEC))
+register_sink("spool", lambda: SpoolSink(SPOOL_DIR, BLOB_COMPRESSION, BLOB_PAYLOAD_CODEC))
+
+@lru_cache(maxsize=None)
+def get_publish_sinks():
+    """Return the fan-out over the configured PUBLISH_SINKS, built on first use."""
+    return SinkFanout([get_sink(name) for name in PUBLISH_SINKS])
+
+def run_once(select_tables=None):
+    """
+    Run one extraction poll and write every batch to all publish sinks; `select_tables` limits the
+    poll to this worker's tables. A table's LSN checkpoint is saved at the end of the poll, and only
+    if every sink accepted all of its batches; otherwise its window is extracted again next poll.
+    A table whose snapshot started during the poll is dropped from it, since the snapshot supersedes its changes.
+    Returns (records published, whether any table still has changes beyond its window).
+    """
+    backlog = set()
+    windows = {}  # table -> upper LSN of its extracted window, saved once published
+    if EXTRACT_CONCURRENCY > 1:
+        batches = iter_cdc_changes_parallel(backlog=backlog, select_tables=select_tables, checkpoint=windows.__setitem__)
+    else:
+        batches = iter_cdc_changes(backlog=backlog, select_tables=select_tables, checkpoint=windows.__setitem__)
+
+    sinks = get_publish_sinks()
+    failed = set()
+    total = 0
+    for batch in batches:
+        if batch.table in failed:
+            continue
+        if snapshot_in_progress(batch.table):
+            log_info(f"Snapshot of {batch.table} started during the poll; its remaining changes are left to the snapshot")
+            failed.add(batch.table)
+            continue
+        try:
+            sinks.write(batch)
+        except SinkError as e:
+            log_error(f"Publishing {batch.table} failed ({e}); its LSN checkpoint is kept and the window retried next poll")
+            failed.add(batch.table)
+            continue
+        ROWS_PUBLISHED.inc(len(batch), table=batch.table)
+        total += len(batch)
+
+    for table, lsn in windows.items():
+        if table not in failed and not snapshot_in_progress(table):
+            save_last_processed_lsn(table, lsn)
+    return total, bool(backlog)
 
 def main():
     """Main execution function."""
     try:
         log_info("Starting CDC extraction...")
-        cdc_changes = extract_cdc_changes()
+        total, _ = run_once()
 
-        if cdc_changes:
-            log_info(f"Processing {len(cdc_changes)} CDC changes")
-            publish_to_queue(cdc_changes)  # Send CDC changes to queue
-            upload_to_blob(cdc_changes)  # Upload CDC changes to Blob Storage
+        if total:
+            log_info(f"Processed {total} CDC changes")
             log_info("CDC processing completed successfully")
         else:
             log_info("No CDC changes to process")
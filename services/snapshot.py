@@ -0,0 +1,308 @@
+import argparse
+import datetime
+import decimal
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config.azure_storage import AZURE_STORAGE_CONFIG
+from config.db_config import DB_CONFIG
+from services import publisher, subscriber
+from utils.blob_store import lsn_fence_name, table_prefix
+from utils.columnar import ColumnarBatch
+from utils.logger import log_info, log_error
+from utils.metrics import ROWS_EXTRACTED, STAGE_SECONDS
+
+# Approximate rows per primary-key range; each range is read, loaded and checkpointed on its own
+SNAPSHOT_CHUNK_ROWS = DB_CONFIG.get("snapshot_chunk_rows", 1000000)
+# Key ranges copied in parallel, each on its own SQL Server connection
+SNAPSHOT_CONCURRENCY = DB_CONFIG.get("snapshot_concurrency", publisher.EXTRACT_CONCURRENCY)
+# Rows fetched and merged into Snowflake at a time within a range
+SNAPSHOT_LOAD_ROWS = DB_CONFIG.get("snapshot_load_rows", 100000)
+# Snapshot rows are stamped as inserts at the snapshot LSN, so any later CDC change supersedes them
+OP_INSERT = 2
+# Key bound values json cannot hold natively are saved as {kind: text} and rebuilt on load,
+# so a resumed snapshot binds the same parameter types as the run that planned it
+KEY_DECODERS = {
+    "binary": bytes.fromhex,
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "decimal": decimal.Decimal,
+    "uuid": uuid.UUID,
+}
+
+def quote_name(name):
+    return "[" + name.replace("]", "]]") + "]"
+
+def quote_table(table):
+    return ".".join(quote_name(part) for part in table.split(".", 1))
+
+def key_predicate(key_columns, op):
+    """
+    Compare the key columns with parameters in key order, e.g. for ">" on (a, b):
+    ([a] > ? OR ([a] = ? AND [b] > ?)). Bind the values with key_params().
+    """
+    quoted = [quote_name(col) for col in key_columns]
+    strict = op[0]
+    clause = f"{quoted[-1]} {op} ?"
+    for col in reversed(quoted[:-1]):
+        clause = f"({col} {strict} ? OR ({col} = ? AND {clause}))"
+    return clause
+
+def key_params(values):
+    return [value for value in values[:-1] for _ in range(2)] + [values[-1]]
+
+def encode_key_value(value):
+    """Tag a key value json cannot hold natively, e.g. bytes as {"binary": "0a1b"}."""
+    if isinstance(value, (bytes, bytearray)):
+        return {"binary": value.hex()}
+    if isinstance(value, datetime.datetime):  # Checked before date, its base class
+        return {"datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"date": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"time": value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {"decimal": str(value)}
+    if isinstance(value, uuid.UUID):
+        return {"uuid": str(value)}
+    return value
+
+def decode_key_value(value):
+    if isinstance(value, dict):
+        (kind, text), = value.items()
+        return KEY_DECODERS[kind](text)
+    return value
+
+def load_state(table):
+    """Return a table's unfinished snapshot state, or None if no snapshot is in progress."""
+    try:
+        with open(publisher.snapshot_state_file(table), "r") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    state["bounds"] = [[decode_key_value(value) for value in bound] for bound in state["bounds"]]
+    return state
+
+def save_state(table, state):
+    """Write the snapshot state atomically, so a crash never leaves a partial checkpoint."""
+    file_name = publisher.snapshot_state_file(table)
+    bounds = [[encode_key_value(value) for value in bound] for bound in state["bounds"]]
+    with open(f"{file_name}.tmp", "w") as f:
+        json.dump({**state, "bounds": bounds}, f)
+    os.replace(f"{file_name}.tmp", file_name)
+
+def plan_chunks(cursor, table, key_columns, chunk_rows):
+    """
+    Split a table into primary-key ranges of about `chunk_rows` rows with one ordered
+    scan of the key. Returns the upper bound of every range but the last, which is open.
+    """
+    keys = ", ".join(quote_name(col) for col in key_columns)
+    cursor.execute(f"""
+    SELECT {keys} FROM (
+        SELECT {keys}, ROW_NUMBER() OVER (ORDER BY {keys}) AS rn
+        FROM {quote_table(table)}
+    ) k
+    WHERE rn % ? = 0
+    ORDER BY {keys}
+    """, chunk_rows)
+    return [list(row) for row in cursor.fetchall()]
+
+def snapshot_batch(table, columns, rows, lsn, chunk, offset, metadata=None):
+    """
+    Turn base-table rows into a change batch: inserts at the snapshot LSN, each with a
+    __$seqval unique to its range and position, so reloading a range is idempotent.
+    """
+    batch = ColumnarBatch.from_rows(table, columns, rows, metadata)
+    count = len(batch)
+    seqvals = [f"0x{chunk:08X}{offset + i:012X}" for i in range(count)]
+    types = {**batch.types, "__$start_lsn": "binary", "__$seqval": "binary", "__$operation": "int"}
+    return ColumnarBatch(
+        table,
+        ["__$start_lsn", "__$seqval", "__$operation"] + batch.columns,
+        [[lsn] * count, seqvals, [OP_INSERT] * count] + batch.data,
+        {**batch.metadata, "types": types}
+    )
+
+def copy_chunk(table, state, chunk, metadata=None):
+    """Read one primary-key range of the base table and merge it into Snowflake; returns the rows copied."""
+    bounds = state["bounds"]
+    conditions, params = [], []
+    if chunk > 0:
+        conditions.append(key_predicate(state["key"], ">"))
+        params += key_params(bounds[chunk - 1])
+    if chunk < len(bounds):
+        conditions.append(key_predicate(state["key"], "<="))
+        params += key_params(bounds[chunk])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    keys = ", ".join(quote_name(col) for col in state["key"])
+
+    copied = 0
+    with publisher.sql_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT * FROM {quote_table(table)} {where} ORDER BY {keys}", *params)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                started = time.perf_counter()
+                rows = cursor.fetchmany(SNAPSHOT_LOAD_ROWS)
+                if not rows:
+                    break
+                ROWS_EXTRACTED.inc(len(rows), table=table)
+                batch = snapshot_batch(table, columns, rows, state["lsn"], chunk, copied, metadata)
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage="snapshot")
+                subscriber.load_table_batch(table.replace(".", "_"), batch)
+                copied += len(rows)
+        finally:
+            cursor.close()
+    return copied
+
+def skip_blob_backlog(table, lsn):
+    """
+    Move the subscriber's blob watermark to the snapshot LSN, past every batch object holding
+    changes up to it, which the snapshot supersedes. Objects a poll that started before the
+    snapshot uploads later sort below the watermark too, so they are skipped rather than
+    loaded over the snapshot; objects after the LSN are left to load as usual.
+    """
+    store = subscriber.get_blob_store(AZURE_STORAGE_CONFIG)
+    watermark = subscriber.get_blob_watermark(table)
+    fence = lsn_fence_name(table, lsn)
+    if watermark is None or watermark < fence:
+        subscriber.save_blob_watermark(table, fence)
+    names = store.list(table_prefix(table), start_after=watermark)
+    subscriber.archive_loaded(store, [name for name in names if name <= fence])
+
+def truncate_target(table):
+    table_name = table.replace(".", "_")
+    with subscriber.snowflake_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"TRUNCATE TABLE IF EXISTS {subscriber.qualified_table_name(table_name)}")
+            conn.commit()
+        finally:
+            cursor.close()
+    log_info(f"Truncated {table_name} before re-seeding it")
+
+def start_snapshot(table, chunk_rows, truncate=False):
+    """Record the current max LSN and plan the key ranges; returns the new state, or None if the table cannot be snapshotted."""
+    with publisher.sql_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            max_lsn = publisher.get_max_lsn(cursor)  # Recorded before the base table is read
+            key_columns = publisher.get_primary_key(cursor, table)
+            if not max_lsn or not key_columns:
+                log_error(f"Cannot snapshot {table}: " + ("it has no primary key" if max_lsn else "CDC has no LSN yet"))
+                return None
+            bounds = plan_chunks(cursor, table, key_columns, chunk_rows)
+        finally:
+            cursor.close()
+
+    state = {"lsn": publisher.lsn_to_hex(max_lsn), "key": key_columns, "bounds": bounds, "done": []}
+    save_state(table, state)  # From here on the publisher leaves the table alone
+    skip_blob_backlog(table, state["lsn"])
+    if truncate:
+        truncate_target(table)
+    log_info(f"Snapshot of {table} at LSN {state['lsn']}: {len(bounds) + 1} key ranges of about {chunk_rows} rows")
+    return state
+
+def finish_snapshot(table, state):
+    """Hand the table over to incremental CDC from the snapshot LSN."""
+    publisher.save_last_processed_lsn(table, state["lsn"])
+    os.remove(publisher.snapshot_state_file(table))
+
+    with publisher.sql_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT sys.fn_cdc_get_min_lsn(?)", publisher.get_capture_instance(table))
+            min_lsn = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+    if min_lsn and min_lsn > publisher.hex_to_lsn(state["lsn"]):
+        log_error(
+            f"CDC cleanup purged changes to {table} made during its snapshot; raise the CDC retention "
+            f"and re-seed it with --truncate"
+        )
+
+def snapshot_table(table, chunk_rows=SNAPSHOT_CHUNK_ROWS, workers=SNAPSHOT_CONCURRENCY, truncate=False):
+    """
+    Copy a table's current contents into Snowflake, then switch it to incremental CDC.
+
+    The source's max LSN is recorded first; the base table is then copied in parallel
+    primary-key ranges, each merged into Snowflake as inserts stamped with that LSN and
+    checkpointed once loaded, so an interrupted snapshot resumes with the missing ranges.
+    Changes committed while the snapshot runs are stamped with later LSNs and applied by
+    the regular CDC flow afterwards. Returns True once the table is handed over.
+    """
+    state = load_state(table)
+    if state is None:
+        state = start_snapshot(table, chunk_rows, truncate)
+        if state is None:
+            return False
+    else:
+        log_info(f"Resuming snapshot of {table} at LSN {state['lsn']}: {len(state['done'])} of {len(state['bounds']) + 1} key ranges done")
+
+    metadata = {**(publisher.get_source_metadata(table) or {}), "primary_key": state["key"]}
+    pending = [chunk for chunk in range(len(state["bounds"]) + 1) if chunk not in state["done"]]
+    lock = threading.Lock()
+    failed = []
+    started = time.monotonic()
+
+    def run(chunk):
+        try:
+            copied = copy_chunk(table, state, chunk, metadata)
+        except Exception as e:
+            log_error(f"Snapshot of {table} key range {chunk} failed: {e}")
+            failed.append(chunk)
+            return 0
+        with lock:
+            state["done"].append(chunk)
+            save_state(table, state)
+        return copied
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="cdc-snapshot") as executor:
+        copied = sum(executor.map(run, pending))
+
+    if failed:
+        log_error(f"Snapshot of {table} incomplete: {len(failed)} key ranges failed; run it again to resume")
+        return False
+
+    finish_snapshot(table, state)
+    log_info(f"Snapshot of {table} copied {copied} rows in {time.monotonic() - started:.1f}s; switched to CDC after {state['lsn']}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed Snowflake from a parallel, resumable snapshot of CDC-enabled source tables.")
+    parser.add_argument(
+        "tables", nargs="*",
+        help="Source tables as schema.table (default: CDC tables without an LSN checkpoint, and unfinished snapshots)"
+    )
+    parser.add_argument("--workers", type=int, default=SNAPSHOT_CONCURRENCY, help="Key ranges copied in parallel")
+    parser.add_argument("--chunk-rows", type=int, default=SNAPSHOT_CHUNK_ROWS, help="Approximate rows per key range")
+    parser.add_argument("--truncate", action="store_true", help="Empty each target table before a new snapshot, to re-seed it")
+    args = parser.parse_args()
+
+    cdc_tables = publisher.get_cdc_enabled_tables()  # Also loads the source catalog with exact column types
+    tables = args.tables or [
+        table for table in cdc_tables
+        if publisher.get_last_processed_lsn(table) is None or load_state(table) is not None
+    ]
+
+    try:
+        for table in tables:
+            if table not in cdc_tables:
+                log_error(f"{table} is not a CDC-enabled table; skipping its snapshot")
+                continue
+            try:
+                snapshot_table(table, args.chunk_rows, args.workers, args.truncate)
+            except Exception as e:
+                log_error(f"Snapshot of {table} failed: {e}")
+    finally:
+        publisher.sql_pool.close_all()
+        subscriber.snowflake_pool.close_all()
+
+if __name__ == "__main__":
+    main()
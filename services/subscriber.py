@@ -1,16 +1,112 @@
-import json
+import datetime
+import gzip
+import multiprocessing
+import os
+import tempfile
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
 import snowflake.connector
-from azure.storage.blob import BlobServiceClient
 from config.azure_storage import AZURE_STORAGE_CONFIG
 from config.db_config import SNOWFLAKE_CONFIG
-from utils.logger import log_info, log_error
-
-CDC_FILE = "cdc_changes.json"
-# "__$start_lsn""__$operation""__$command_id"
+from utils.logger import log_info, log_error, log_summary
+from utils.queue_handler import DEFAULT_CONSUMER, read_from_queue, ack_queue, compact_queue
+from utils.schema_registry import SchemaRegistry
+from utils.connection_pool import ConnectionPool
+from utils.blob_store import get_blob_store, stream_batch, read_batch, table_prefix, archive_name, BATCH_PREFIX
+from utils.batching import BatchSizer, TableBuffers
+from utils.columnar import ColumnarBatch
+from utils.metrics import ROWS_LOADED, STAGE_SECONDS, REPLICATION_LAG, REPLICATION_LAG_SECONDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet staging is optional; CSV is always available
+    pa = None
+
+# Where CDC batches are read from: "blob" (Azure Blob Storage) or "queue" (local segment log)
+CDC_SOURCE = SNOWFLAKE_CONFIG.get("cdc_source", "blob")
+QUEUE_READ_BATCH = 10
+# Batches smaller than this are loaded with multi-row INSERT instead of PUT + COPY INTO
+BULK_LOAD_MIN_ROWS = SNOWFLAKE_CONFIG.get("bulk_load_min_rows", 1000)
+# Staged file format: "csv" (gzip) or "parquet" (snappy, requires pyarrow)
+BULK_FILE_FORMAT = SNOWFLAKE_CONFIG.get("bulk_file_format", "csv")
+BULK_FILE_ROWS = SNOWFLAKE_CONFIG.get("bulk_file_rows", 250000)
+INSERT_CHUNK_ROWS = 1000
+# "__$start_lsn""__$operation""__$command_id""__$seqval"
 EXCLUDED_COLUMNS = {
-     "__$end_lsn", "__$seqval", 
+     "__$end_lsn",
     "__$update_mask"
 }
+# Overrides of the key changes are merged on per target table, e.g. {"dbo_actor": ["actor_id"]}; by default
+# the source primary key sent in batch metadata is used, and tables without one are only ever inserted
+MERGE_KEYS = SNOWFLAKE_CONFIG.get("merge_keys", {})
+CHANGE_KEY = ["__$start_lsn", "__$seqval"]
+# __$operation values: 1 = delete, 2 = insert, 3 = update before-image, 4 = update after-image
+OP_DELETE = 1
+OP_BEFORE_IMAGE = 3
+# Snowflake column types by inference rank; a column takes the widest type seen in the batch
+TYPE_RANKS = ["VARIANT", "INT", "FLOAT", "STRING", "VARIANT"]
+# Snowflake column types for the SQL value kinds carried in batch metadata (see utils.columnar)
+KIND_TYPES = {
+    "bool": "BOOLEAN",
+    "int": "INT",
+    "float": "FLOAT",
+    "str": "STRING",
+    "binary": "STRING",  # Kept as '0x...' hex so LSN columns compare in order
+    "uuid": "STRING",
+    "datetime": "TIMESTAMP_NTZ",
+    "datetimeoffset": "TIMESTAMP_TZ",
+    "date": "DATE",
+    "time": "TIME",
+}
+# Snowflake column types for exact SQL Server source types carried in batch metadata ("source_types");
+# parameterized types are mapped in source_column_type()
+SOURCE_TYPES = {
+    "bit": "BOOLEAN",
+    "tinyint": "NUMBER(3, 0)",
+    "smallint": "NUMBER(5, 0)",
+    "int": "NUMBER(10, 0)",
+    "bigint": "NUMBER(19, 0)",
+    "money": "NUMBER(19, 4)",
+    "smallmoney": "NUMBER(10, 4)",
+    "real": "FLOAT",
+    "float": "FLOAT",
+    "date": "DATE",
+    "datetime": "TIMESTAMP_NTZ(3)",
+    "smalldatetime": "TIMESTAMP_NTZ(0)",
+    "uniqueidentifier": "VARCHAR(36)",
+    "text": "VARCHAR",
+    "ntext": "VARCHAR",
+    "xml": "VARCHAR",
+}
+SCHEMA_CACHE_TTL = SNOWFLAKE_CONFIG.get("schema_cache_ttl", 300)
+# Long-lived Snowflake sessions shared by every subscriber operation
+SESSION_POOL_SIZE = SNOWFLAKE_CONFIG.get("session_pool_size", 4)
+SESSION_KEEPALIVE_SECONDS = SNOWFLAKE_CONFIG.get("session_keepalive_seconds", 600)
+# Streamed blob records are loaded whenever a table's buffer reaches any of these limits
+LOAD_BUFFER_ROWS = SNOWFLAKE_CONFIG.get("load_buffer_rows", 50000)
+LOAD_BUFFER_SECONDS = SNOWFLAKE_CONFIG.get("load_buffer_seconds", 30)
+LOAD_BUFFER_BYTES = SNOWFLAKE_CONFIG.get("load_buffer_bytes", 256 * 1024 * 1024)
+# Replication lag to aim for; when set, each table's buffer limits are tuned from its measured load times
+TARGET_LAG_SECONDS = SNOWFLAKE_CONFIG.get("target_lag_seconds")
+LOAD_BUFFER_MIN_ROWS = SNOWFLAKE_CONFIG.get("load_buffer_min_rows", 1000)
+LOAD_BUFFER_MAX_ROWS = SNOWFLAKE_CONFIG.get("load_buffer_max_rows", 1000000)
+# Tables loaded concurrently from blob storage, each on its own pooled session; 1 loads them in turn
+LOAD_CONCURRENCY = SNOWFLAKE_CONFIG.get("load_concurrency", SESSION_POOL_SIZE)
+# Worker processes that download, decompress and parse batch objects; 0 decodes on the loading threads
+DECODE_PROCESSES = SNOWFLAKE_CONFIG.get("decode_processes", 0)
+# Batch objects per table decoded ahead of the one being loaded when DECODE_PROCESSES is set
+DECODE_PREFETCH = 2
+# Loaded batch objects are moved under this prefix, so listing a table only returns unloaded ones; None keeps them in place
+BLOB_ARCHIVE_PREFIX = AZURE_STORAGE_CONFIG.get("archive_prefix", "loaded")
+
+schema_registry = SchemaRegistry(ttl_seconds=SCHEMA_CACHE_TTL)
+batch_sizer = BatchSizer(
+    TARGET_LAG_SECONDS, LOAD_BUFFER_MIN_ROWS, LOAD_BUFFER_MAX_ROWS, LOAD_BUFFER_BYTES,
+    initial_rows=LOAD_BUFFER_ROWS, initial_seconds=LOAD_BUFFER_SECONDS
+) if TARGET_LAG_SECONDS else None
 
 def connect_snowflake():
     """Establish connection to Snowflake."""
@@ -20,255 +116,547 @@ def connect_snowflake():
             password=SNOWFLAKE_CONFIG["password"],
             account=SNOWFLAKE_CONFIG["account"],
             database=SNOWFLAKE_CONFIG["database"],
-            schema=SNOWFLAKE_CONFIG["schema"]
+            schema=SNOWFLAKE_CONFIG["schema"],
+            client_session_keep_alive=True
         )
         log_info("Successfully connected to Snowflake")
         return conn
     except Exception as e:
         log_error(f" Snowflake Connection Failed: {e}")
-        return None
+        raise
 
-def table_exists(table_name):
-    """Check if the CDC table exists in Snowflake."""
-    conn = connect_snowflake()
-    if not conn:
+def check_snowflake_session(conn):
+    """Health check for pooled sessions: the session is open and answers a trivial query."""
+    if conn.is_closed():
         return False
-
     cursor = conn.cursor()
     try:
-        cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-        exists = cursor.fetchone() is not None
-        return exists
+        cursor.execute("SELECT 1")
+        return cursor.fetchone() is not None
     finally:
         cursor.close()
-        conn.close()
-
-def create_table_if_not_exists(json_data):
-    """Creates table dynamically based on JSON structure, excluding CDC metadata columns."""
-    table_name = json_data[0].get("_source_table")
-    if not table_name:
-        log_error("'_source_table' key is missing in JSON data")
-        return
 
-    table_name = table_name.replace(".", "_")  # Convert to Snowflake-compatible format
-
-    if table_exists(table_name):
-        return
-
-    columns = []
-    for key, value in json_data[0].items():
-        if key in EXCLUDED_COLUMNS or key == "_source_table":  # Exclude metadata and table name
-            continue
-        if isinstance(value, int):
-            columns.append(f'"{key}" INT')
-        elif isinstance(value, float):
-            columns.append(f'"{key}" FLOAT')
-        elif isinstance(value, str):
-            columns.append(f'"{key}" STRING')
-        else:
-            columns.append(f'"{key}" VARIANT')
-
-    column_definitions = ", ".join(columns)
-    create_table_query = f"""
-    CREATE TABLE {SNOWFLAKE_CONFIG['database']}.{SNOWFLAKE_CONFIG['schema']}.{table_name} 
-    ({column_definitions})
+snowflake_pool = ConnectionPool(
+    connect_snowflake,
+    max_size=SESSION_POOL_SIZE,
+    name="Snowflake",
+    validate=check_snowflake_session,
+    keepalive_interval=SESSION_KEEPALIVE_SECONDS
+)
+
+def qualified_table_name(table_name):
+    """Return the fully qualified Snowflake name for a target table."""
+    return f"{SNOWFLAKE_CONFIG['database']}.{SNOWFLAKE_CONFIG['schema']}.{table_name}"
+
+def decimal_type(values):
+    """NUMBER type wide enough for the largest scale seen in a decimal column."""
+    scale = max((-value.as_tuple().exponent for value in values if value is not None), default=0)
+    return f"NUMBER(38, {min(max(scale, 0), 37)})"
+
+def source_column_type(source_type):
+    """Map an exact SQL Server type such as "decimal(18,4)" or "nvarchar(50)" to a Snowflake type; None if unknown."""
+    name, _, size = source_type.lower().partition("(")
+    size = size.rstrip(")")
+    if name in SOURCE_TYPES:
+        return SOURCE_TYPES[name]
+    if name in ("decimal", "numeric") and size:
+        return f"NUMBER({size.replace(',', ', ')})"
+    if name in ("char", "varchar", "nchar", "nvarchar"):
+        return f"VARCHAR({size})" if size.isdigit() else "VARCHAR"
+    if name in ("binary", "varbinary", "image", "timestamp", "rowversion"):
+        return "STRING"  # Kept as '0x...' hex, like other binary columns
+    if name == "datetime2":
+        return f"TIMESTAMP_NTZ({size or 7})"
+    if name == "datetimeoffset":
+        return f"TIMESTAMP_TZ({size or 7})"
+    if name == "time":
+        return f"TIME({size or 7})"
+    return None
+
+def infer_column_types(columns, data, kinds=None, source_types=None):
     """
-    
-    conn = connect_snowflake()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(create_table_query)
-        log_info(f" Table '{table_name}' created successfully")
-    finally:
-        cursor.close()
-        conn.close()
+    Pick a Snowflake type for each column: from its exact source type when the
+    publisher's catalog provides one, else from its SQL value kind when the batch
+    carries one, otherwise inferred from every value in the column, widening on conflicts.
+    """
+    types = {}
+    kinds = kinds or {}
+    source_types = source_types or {}
+    for column, values in zip(columns, data):
+        column_type = source_column_type(source_types[column]) if column in source_types else None
+        if column_type:
+            types[column] = column_type
+            continue
+        kind = kinds.get(column)
+        if kind == "decimal":
+            types[column] = decimal_type(values)
+            continue
+        if kind in KIND_TYPES:
+            types[column] = KIND_TYPES[kind]
+            continue
 
-def get_existing_columns(table_name):
-    """Fetch existing column names from Snowflake."""
-    conn = connect_snowflake()
-    cursor = conn.cursor()
-    
+        rank = 0
+        for value in values:
+            if value is None:
+                continue
+            if isinstance(value, int):
+                rank = max(rank, 1)
+            elif isinstance(value, float):
+                rank = max(rank, 2)
+            elif isinstance(value, str):
+                rank = max(rank, 3)
+            else:
+                rank = 4
+                break
+        types[column] = TYPE_RANKS[rank]
+    return types
+
+def get_existing_columns(cursor, table_name):
+    """Fetch existing column names and types from Snowflake; empty if the table does not exist."""
     query = f"""
-    SELECT COLUMN_NAME 
+    SELECT COLUMN_NAME, DATA_TYPE
     FROM INFORMATION_SCHEMA.COLUMNS 
     WHERE TABLE_CATALOG = '{SNOWFLAKE_CONFIG['database']}'
     AND TABLE_SCHEMA = '{SNOWFLAKE_CONFIG['schema']}' 
     AND TABLE_NAME = '{table_name.upper()}'
     """  # Ensure table name is in uppercase as Snowflake stores names in uppercase by default
-    
+
     cursor.execute(query)
-    columns = {row[0].lower() for row in cursor.fetchall()}  # Convert to lowercase for case-insensitive comparison
-    
-    cursor.close()
-    conn.close()
-    return columns
-
-def add_missing_columns(record):
-    """Add any missing columns based on the JSON data, excluding CDC metadata columns."""
-    table_name = record.get("_source_table")
-    if not table_name:
-        log_error(" '_source_table' key is missing in record")
+    return {row[0].lower(): row[1] for row in cursor.fetchall()}  # Convert to lowercase for case-insensitive comparison
+
+def ensure_table_schema(cursor, table_name, columns, data, version=None, kinds=None, source_types=None):
+    """
+    Make sure the target table exists with every column in the batch.
+    Served from the schema registry when the cached schema already covers the
+    batch and `version` (the source catalog version) is unchanged; otherwise the
+    schema is reloaded once and the table is created, or all missing columns are
+    added, in a single DDL statement.
+    """
+    existing = schema_registry.get(table_name, version)
+    if existing is not None and all(col.lower() in existing for col in columns):
         return
 
-    table_name = table_name.replace(".", "_")  # Convert to Snowflake-compatible format
+    existing = get_existing_columns(cursor, table_name)
+    missing = [col for col in columns if col.lower() not in existing]
+
+    if missing:
+        column_types = infer_column_types(columns, data, kinds, source_types)
+        column_definitions = ", ".join(f'"{col}" {column_types[col]}' for col in missing)
+
+        if not existing:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {qualified_table_name(table_name)} ({column_definitions})")
+            log_info(f" Table '{table_name}' created successfully")
+        else:
+            cursor.execute(f"ALTER TABLE {qualified_table_name(table_name)} ADD COLUMN IF NOT EXISTS {column_definitions}")
+            log_info(f" Added new columns to '{table_name}': {missing}")
+
+        existing.update({col.lower(): column_types[col] for col in missing})
+
+    schema_registry.put(table_name, existing, version)
+
+def insert_rows(cursor, table_name, columns, rows):
+    """Load rows with multi-row INSERT statements of up to INSERT_CHUNK_ROWS rows each."""
+    column_list = ", ".join([f'"{col}"' for col in columns])
+    row_placeholder = f"({', '.join(['%s'] * len(columns))})"
+
+    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+        chunk = rows[start:start + INSERT_CHUNK_ROWS]
+        insert_query = f"""
+        INSERT INTO {qualified_table_name(table_name)}
+        ({column_list}) VALUES {", ".join([row_placeholder] * len(chunk))}
+        """
+        cursor.execute(insert_query, [value for row in chunk for value in row])
+
+def csv_field(value):
+    """
+    Quote every non-NULL value (doubling embedded quotes) and write NULL as an empty unquoted
+    field, so no string value, such as "" or "\\N", can be read back as NULL.
+    """
+    if value is None:
+        return ""
+    return '"' + str(value).replace('"', '""') + '"'
+
+def write_csv_files(directory, columns, rows):
+    """Write rows to gzip-compressed CSV files of at most BULK_FILE_ROWS rows; returns the file paths."""
+    paths = []
+    for start in range(0, len(rows), BULK_FILE_ROWS):
+        path = os.path.join(directory, f"part_{len(paths):05d}.csv.gz")
+        with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+            for row in rows[start:start + BULK_FILE_ROWS]:
+                f.write(",".join(csv_field(value) for value in row) + "\n")
+        paths.append(path)
+    return paths
+
+def write_parquet_files(directory, columns, rows):
+    """Write rows to snappy-compressed Parquet files of at most BULK_FILE_ROWS rows; returns the file paths."""
+    paths = []
+    for start in range(0, len(rows), BULK_FILE_ROWS):
+        chunk = rows[start:start + BULK_FILE_ROWS]
+        table = pa.table({col: [row[i] for row in chunk] for i, col in enumerate(columns)})
+        path = os.path.join(directory, f"part_{len(paths):05d}.parquet")
+        pq.write_table(table, path, compression="snappy")
+        paths.append(path)
+    return paths
+
+def stage_and_copy(cursor, table_name, columns, rows):
+    """Write rows to compressed files, PUT them to the user stage and load them with COPY INTO."""
+    use_parquet = BULK_FILE_FORMAT == "parquet" and pa is not None
+    stage = f"@~/cdc_load/{table_name}/{uuid.uuid4().hex}"
+
+    with tempfile.TemporaryDirectory(prefix="cdc_load_") as directory:
+        if use_parquet:
+            paths = write_parquet_files(directory, columns, rows)
+        else:
+            paths = write_csv_files(directory, columns, rows)
+
+        for path in paths:
+            file_url = path.replace(os.sep, "/")
+            cursor.execute(f"PUT 'file://{file_url}' {stage} AUTO_COMPRESS = FALSE PARALLEL = 8")
+
+    if use_parquet:
+        copy_query = f"""
+        COPY INTO {qualified_table_name(table_name)} FROM {stage}
+        FILE_FORMAT = (TYPE = PARQUET)
+        MATCH_BY_COLUMN_NAME = CASE_SENSITIVE
+        PURGE = TRUE
+        """
+    else:
+        column_list = ", ".join([f'"{col}"' for col in columns])
+        copy_query = f"""
+        COPY INTO {qualified_table_name(table_name)} ({column_list}) FROM {stage}
+        FILE_FORMAT = (
+            TYPE = CSV COMPRESSION = GZIP FIELD_OPTIONALLY_ENCLOSED_BY = '"'
+            ESCAPE = NONE ESCAPE_UNENCLOSED_FIELD = NONE NULL_IF = () EMPTY_FIELD_AS_NULL = TRUE
+        )
+        PURGE = TRUE
+        """
+    cursor.execute(copy_query)
+    log_info(f" Bulk loaded {len(rows)} rows from {len(paths)} staged file(s) into table: {table_name}")
+
+def load_rows(cursor, table_name, columns, rows):
+    """Load rows into a Snowflake table, staging large batches and inserting small ones directly."""
+    if len(rows) < BULK_LOAD_MIN_ROWS:
+        insert_rows(cursor, table_name, columns, rows)
+    else:
+        stage_and_copy(cursor, table_name, columns, rows)
+
+def merge_key(table_name, batch):
+    """Return the columns a table's changes are merged on: its merge_keys override, else the batch's source primary key."""
+    return MERGE_KEYS.get(table_name) or batch.metadata.get("primary_key") or []
+
+def build_merge_query(table_name, stage_table, columns, key_columns=None):
+    """
+    Build a MERGE that applies the latest staged change per key to the target table.
+    With key columns, deletes remove the row and inserts/after-images upsert it; otherwise
+    changes are inserted once per (__$start_lsn, __$seqval), or per distinct row when
+    __$seqval is absent (net changes).
+    """
+    keyed = bool(key_columns) and all(col in columns for col in key_columns)
+    quoted = {col: f'"{col}"' for col in columns}
+    order_by = ", ".join(f"{quoted[col]} DESC" for col in CHANGE_KEY if col in columns)
+    insert_columns = ", ".join(quoted[col] for col in columns)
+    insert_values = ", ".join(f"s.{quoted[col]}" for col in columns)
+
+    if not keyed:
+        if "__$seqval" in columns:
+            identity = [col for col in CHANGE_KEY if col in columns]
+            on_clause = " AND ".join(f"t.{quoted[col]} = s.{quoted[col]}" for col in identity)
+        else:
+            # One transaction can hold several changes, so only the whole row identifies one
+            identity = columns
+            on_clause = " AND ".join(f"EQUAL_NULL(t.{quoted[col]}, s.{quoted[col]})" for col in identity)
+        partition_by = ", ".join(quoted[col] for col in identity)
+        return f"""
+        MERGE INTO {qualified_table_name(table_name)} t
+        USING (
+            SELECT * FROM {qualified_table_name(stage_table)}
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition_by} ORDER BY {order_by}) = 1
+        ) s
+        ON {on_clause}
+        WHEN NOT MATCHED THEN INSERT ({insert_columns}) VALUES ({insert_values})
+        """
+
+    partition_by = ", ".join(quoted[col] for col in key_columns)
+    on_clause = " AND ".join(f"t.{quoted[col]} = s.{quoted[col]}" for col in key_columns)
+    update_set = ", ".join(f"t.{quoted[col]} = s.{quoted[col]}" for col in columns if col not in key_columns)
+    return f"""
+    MERGE INTO {qualified_table_name(table_name)} t
+    USING (
+        SELECT * FROM {qualified_table_name(stage_table)}
+        WHERE "__$operation" <> {OP_BEFORE_IMAGE}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY {partition_by} ORDER BY {order_by}) = 1
+    ) s
+    ON {on_clause}
+    WHEN MATCHED AND s."__$operation" = {OP_DELETE} AND s."__$start_lsn" >= t."__$start_lsn" THEN DELETE
+    WHEN MATCHED AND s."__$start_lsn" >= t."__$start_lsn" THEN UPDATE SET {update_set}
+    WHEN NOT MATCHED AND s."__$operation" <> {OP_DELETE} THEN INSERT ({insert_columns}) VALUES ({insert_values})
+    """
+
+def apply_changes(cursor, table_name, columns, rows, key_columns=None):
+    """Load a table's changes into a temporary staging table and apply them with one MERGE on `key_columns`."""
+    stage_table = f"{table_name}_STAGE"
+    cursor.execute(f"CREATE OR REPLACE TEMPORARY TABLE {qualified_table_name(stage_table)} LIKE {qualified_table_name(table_name)}")
+    try:
+        load_rows(cursor, stage_table, columns, rows)
+        cursor.execute(build_merge_query(table_name, stage_table, columns, key_columns))
+        return cursor.fetchone()
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {qualified_table_name(stage_table)}")
 
-    # Fetch existing columns (case-insensitive)
-    existing_columns = get_existing_columns(table_name)
-    conn = connect_snowflake()
+def load_table_records(conn, table_name, batch):
+    """Ensure the target schema and merge one table's ColumnarBatch on a borrowed session."""
     cursor = conn.cursor()
+    try:
+        # Remove CDC metadata columns
+        batch = batch.drop(EXCLUDED_COLUMNS)
+        columns = batch.columns
+        rows = list(batch.rows())
+
+        # Ensure table exists with proper schema
+        ensure_table_schema(
+            cursor, table_name, columns, batch.data,
+            version=batch.metadata.get("schema_version"), kinds=batch.types,
+            source_types=batch.metadata.get("source_types")
+        )
 
-    for column, value in record.items():
-        if column.lower() in existing_columns or column in EXCLUDED_COLUMNS or column == "_source_table":
-            log_info(f"⚠ Column '{column}' already exists or is excluded. Skipping addition.")
+        # Apply changes
+        result = apply_changes(cursor, table_name, columns, rows, merge_key(table_name, batch))
+        conn.commit()
+        log_info(f" Merged {len(rows)} CDC records into table: {table_name} (MERGE result: {result})")
+        record_load(batch, table_name)
+
+    except Exception:
+        schema_registry.invalidate(table_name)  # The target may have changed underneath the cache
+        raise
+    finally:
+        cursor.close()
+
+def record_load(batch, table_name):
+    """Count loaded rows and measure lag from the newest change's source commit (UTC) to now."""
+    table = batch.table or table_name
+    ROWS_LOADED.inc(len(batch), table=table)
+    commit_time = batch.metadata.get("commit_time")
+    if commit_time:
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        lag = (now - datetime.datetime.fromisoformat(commit_time)).total_seconds()
+        REPLICATION_LAG.set(lag, table=table)
+        REPLICATION_LAG_SECONDS.observe(lag, table=table)
+
+def load_table_batch(table_name, batch):
+    """Load one table's ColumnarBatch on a pooled Snowflake session."""
+    log_info(f"Processing table: {table_name} with {len(batch)} records", max_per_minute=60)
+
+    with STAGE_SECONDS.time(stage="load"), snowflake_pool.connection() as conn:
+        load_table_records(conn, table_name, batch)
+
+def process_records(data):
+    """Load a ColumnarBatch, or a legacy list of record dicts, into Snowflake per source table."""
+    batches = [data] if isinstance(data, ColumnarBatch) else ColumnarBatch.from_records(data)
+
+    for batch in batches:
+        if not batch.table:
+            log_error(" '_source_table' key is missing in record")
             continue
-        if isinstance(value, int):
-            col_type = "INT"
-        elif isinstance(value, float):
-            col_type = "FLOAT"
-        elif isinstance(value, str):
-            col_type = "STRING"
-        else:
-            col_type = "VARIANT"
+        load_table_batch(batch.table.replace(".", "_"), batch)
 
-        alter_query = f'ALTER TABLE {SNOWFLAKE_CONFIG["schema"]}.{table_name} ADD COLUMN "{column}" {col_type}'
+def get_blob_watermark(table):
+    """Retrieve the name of the last batch object loaded for a table."""
+    file_name = f"blob_watermark_{table.replace('.', '_')}.txt"
+    try:
+        with open(file_name, "r") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None  # First-time execution
+
+def save_blob_watermark(table, blob_name):
+    """Save the last loaded batch object so it is never listed again."""
+    file_name = f"blob_watermark_{table.replace('.', '_')}.txt"
+    with open(file_name, "w") as f:
+        f.write(blob_name)
+
+def archive_loaded(store, names):
+    """
+    Move loaded batch objects out of the listed prefix under BLOB_ARCHIVE_PREFIX. A failure is
+    logged and leaves the rest in place; they sort at or below the watermark, so the next load
+    of the table skips them and archives them again.
+    """
+    if not BLOB_ARCHIVE_PREFIX:
+        return
+    for name in names:
         try:
-            cursor.execute(alter_query)
-            log_info(f" Added new column: {column}")
-            existing_columns.add(column.lower())  # Add the new column to the set to avoid duplicate attempts
+            store.move(name, archive_name(name, BLOB_ARCHIVE_PREFIX))
         except Exception as e:
-            log_error(f" Error adding column '{column}': {e}")
+            log_error(f" Error archiving {name}: {e}. It will be archived on a later run.")
+            return
 
-    cursor.close()
-    conn.close()
+@lru_cache(maxsize=None)
+def get_decode_pool():
+    """Return the shared process pool for decoding batch objects, started on first use."""
+    # Spawned rather than forked: the subscriber runs threads (session keepalive, log writer)
+    return ProcessPoolExecutor(max_workers=DECODE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
 
-def record_exists_in_snowflake(record, cursor):
+def iter_batch_objects(store, names):
     """
-    Check if a record already exists in Snowflake before inserting.
-    Handles case-insensitive column name matching.
+    Yield (name, ColumnarBatch chunks) for a table's batch objects in order. With
+    DECODE_PROCESSES, objects are decoded in worker processes up to DECODE_PREFETCH ahead.
+    Either way, a read or checksum error is raised while iterating the object's chunks.
     """
-    # Identify unique columns for deduplication (e.g., primary key or unique identifier)
-    unique_columns = [col for col in record.keys() if col.lower() not in EXCLUDED_COLUMNS and col != "_source_table"]
-    
-    if not unique_columns:
-        log_error("⚠ No unique columns found in record for deduplication. Skipping record.")
-        return False
+    def decoded(future):
+        yield from future.result()
 
-    # Safely quote the table and column names
-    table_name = record.get("_source_table")
-    if not table_name:
-        log_error(" '_source_table' key is missing in record")
-        return False
+    if not DECODE_PROCESSES:
+        for name in names:
+            yield name, stream_batch(store, name)
+        return
 
-    table_name = f"{SNOWFLAKE_CONFIG['database']}.{SNOWFLAKE_CONFIG['schema']}.{table_name.replace('.', '_')}"
+    pending = deque()
+    try:
+        for name in names:
+            pending.append((name, get_decode_pool().submit(read_batch, AZURE_STORAGE_CONFIG, name)))
+            if len(pending) > DECODE_PREFETCH:
+                name, future = pending.popleft()
+                yield name, decoded(future)
+        while pending:
+            name, future = pending.popleft()
+            yield name, decoded(future)
+    finally:
+        for _, future in pending:
+            future.cancel()
 
-    # Build the WHERE clause for deduplication
-    where_clause = " AND ".join([f'"{col}" = %s' for col in unique_columns])
-    values = tuple(record[col] for col in unique_columns)
+def load_blob_table(store, table, failed=None):
+    """
+    Stream one table's batch objects written since its watermark into Snowflake, in order.
+    An object's chunks are buffered only once the whole object has been read and its checksum
+    verified, so a corrupt object loads nothing. The watermark advances only after the table's
+    buffered records have been loaded; a failure is logged and leaves it in place, so the table
+    is retried from there on the next run, and the table is added to the `failed` set if given.
+    Loaded objects are then archived, so the table's listing stays as short as its backlog.
+    Returns (objects read, records loaded).
+    """
+    table_name = table.replace(".", "_")
+    buffers = TableBuffers(load_table_batch, LOAD_BUFFER_ROWS, LOAD_BUFFER_SECONDS, LOAD_BUFFER_BYTES, batch_sizer)
+    objects = records = 0
+    last_loaded = None
 
     try:
-        query = f"SELECT COUNT(*) FROM {table_name} WHERE {where_clause}"
-        cursor.execute(query, values)
-        
-        exists = cursor.fetchone()[0] > 0
-        return exists
+        watermark = get_blob_watermark(table)
+        names = store.list(table_prefix(table))
+        if watermark is not None:
+            # Objects at or below the watermark were loaded but not archived, e.g. after a crash
+            archive_loaded(store, [name for name in names if name <= watermark])
+            names = [name for name in names if name > watermark]
+        batch_objects = iter_batch_objects(store, names)
+        try:
+            for name, chunks in batch_objects:
+                try:
+                    verified = list(chunks)  # Objects hold one extracted batch, so this stays bounded
+                except (IOError, ValueError) as e:
+                    log_error(f" Error reading {name}: {e}. Stopping {table} at the previous batch.")
+                    if failed is not None:
+                        failed.add(table)
+                    break
+
+                count = 0
+                for chunk in verified:
+                    buffers.add(table_name, chunk)
+                    count += len(chunk)
+                objects += 1
+                records += count
+                last_loaded = name
+        finally:
+            batch_objects.close()
+
+        buffers.flush_all()
+        if last_loaded:
+            save_blob_watermark(table, last_loaded)
+            archive_loaded(store, [name for name in names if name <= last_loaded])
+        return objects, records
+
     except Exception as e:
-        log_error(f" Error checking record existence: {e}")
-        return False
+        log_error(f" Error loading {table}: {e}. It will be retried from its last loaded batch.")
+        if failed is not None:
+            failed.add(table)
+        return 0, 0
 
-def download_and_process_blob():
-    """Download CDC JSON from Azure and process it."""
+def download_and_process_blob(select_tables=None, failed=None):
+    """
+    Stream the CDC batch objects written since each table's watermark and process them in order.
+    Rows are parsed incrementally into columnar chunks and loaded from bounded per-table buffers, so memory
+    depends on the buffer limits rather than on blob size. Up to LOAD_CONCURRENCY tables load at once,
+    so a large table does not hold up the others, and an error in one table does not affect the rest.
+    `select_tables` narrows the source tables to those this worker owns in multi-worker mode.
+    Tables that could not be loaded up to their newest object are added to the `failed` set
+    if given ("*" if the tables could not be listed).
+    """
     try:
-        # Download from Azure Blob
-        blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONFIG["connection_string"])
-        blob_client = blob_service_client.get_blob_client(
-            container=AZURE_STORAGE_CONFIG["container_name"], 
-            blob=CDC_FILE
-        )
-        
-        download_stream = blob_client.download_blob()
-        json_data = json.loads(download_stream.readall())
-        log_info(f" Downloaded CDC JSON from Azure Blob Storage: {len(json_data)} records")
-
-        if not json_data:
-            log_info("⚠ No records to process")
-            return
-
-        # Group records by '_source_table'
-        records_by_table = {}
-        for record in json_data:
-            table_name = record.get("_source_table")
-            if not table_name:
-                log_error(" '_source_table' key is missing in record")
-                continue
-            table_name = table_name.replace(".", "_")
-            records_by_table.setdefault(table_name, []).append(record)
-
-        # Process each table's records
-        for table_name, records in records_by_table.items():
-            log_info(f"Processing table: {table_name} with {len(records)} records")
-
-            # Ensure table exists with proper schema
-            create_table_if_not_exists(records)
-            add_missing_columns(records[0])
-
-            # Insert data
-            conn = connect_snowflake()
-            cursor = conn.cursor()
-
-            try:
-                # Filter out existing records
-                filtered_data = []
-                unique_records = set()
-                
-                for record in records:
-                    # Remove CDC metadata columns
-                    filtered_record = {k: v for k, v in record.items() if k not in EXCLUDED_COLUMNS and k != "_source_table"}
-
-                    # Generate a unique key for deduplication (e.g., based on sorted key-value pairs)
-                    record_key = tuple(sorted(filtered_record.items()))
-                    
-                    # Check for duplicates within the batch
-                    if record_key in unique_records:
-                        log_info(f"⚠ Duplicate record found in batch for table: {table_name}. Skipping.")
-                        continue
-                    
-                    # Check for duplicates in Snowflake
-                    if not record_exists_in_snowflake(record, cursor):
-                        filtered_data.append(filtered_record)
-                        unique_records.add(record_key)
-                    else:
-                        log_info(f"⚠ Record already exists in Snowflake for table: {table_name}. Skipping.")
-
-                if not filtered_data:
-                    log_info(f"⚠ No new records to insert for table: {table_name}")
-                    continue
-
-                # Log details about filtered records
-                log_info(f"Total records for table {table_name}: {len(records)}")
-                log_info(f"Unique records to insert for table {table_name}: {len(filtered_data)}")
-
-                column_list = ", ".join([f'"{col}"' for col in filtered_data[0].keys()])
-                value_placeholders = ", ".join(["%s"] * len(filtered_data[0]))
-                insert_query = f"""
-                INSERT INTO {SNOWFLAKE_CONFIG['database']}.{SNOWFLAKE_CONFIG['schema']}.{table_name} 
-                ({column_list}) VALUES ({value_placeholders})
-                """
-
-                cursor.executemany(insert_query, [tuple(record.values()) for record in filtered_data])
-                conn.commit()
-                log_info(f" {len(filtered_data)} new records inserted into table: {table_name}")
-
-            finally:
-                cursor.close()
-                conn.close()
+        store = get_blob_store(AZURE_STORAGE_CONFIG)
+        tables = [prefix[len(BATCH_PREFIX) + 1:-1] for prefix in store.list_prefixes(f"{BATCH_PREFIX}/")]
+        if select_tables is not None:
+            tables = select_tables(tables)
+
+        summary = log_summary("Streamed batch objects from Azure Blob Storage")
+        if LOAD_CONCURRENCY > 1 and len(tables) > 1:
+            with ThreadPoolExecutor(max_workers=min(LOAD_CONCURRENCY, len(tables)), thread_name_prefix="cdc-load") as executor:
+                results = list(executor.map(lambda table: load_blob_table(store, table, failed), tables))
+        else:
+            results = [load_blob_table(store, table, failed) for table in tables]
+
+        total = 0
+        for objects, records in results:
+            summary.add("objects", objects)
+            summary.add("records", records)
+            if objects:
+                summary.add("tables")
+            total += records
+
+        if total:
+            summary.emit()
+        else:
+            log_info("⚠ No records to process", max_per_minute=2)
+        return total
 
     except Exception as e:
         log_error(f" Error processing CDC data: {e}")
+        if failed is not None:
+            failed.add("*")
+        return 0
+
+def process_queue(max_items=QUEUE_READ_BATCH):
+    """Load CDC batches handed off through the local queue, acknowledging each once loaded."""
+    total = 0
+    try:
+        while True:
+            items = read_from_queue(DEFAULT_CONSUMER, max_items)
+            if not items:
+                break
+
+            for offset, batch in items:
+                process_records(batch)
+                ack_queue(DEFAULT_CONSUMER, offset)
+                total += len(batch)
+
+        log_info(f"Processed {total} CDC records from the local queue")
+        compact_queue()
+    except Exception as e:
+        log_error(f" Error processing CDC queue: {e}")
+    return total
+
+def run_once(select_tables=None):
+    """
+    Load everything currently available from the configured source; returns the records processed.
+    With `select_tables`, blob batches are loaded only for this worker's tables. The local queue has a
+    single consumer position, so it is treated as one unit owned by whichever worker selects it.
+    """
+    if CDC_SOURCE == "queue":
+        if select_tables is not None and not select_tables([DEFAULT_CONSUMER]):
+            return 0
+        return process_queue()
+    return download_and_process_blob(select_tables)
 
 def main():
     """Main function to run the CDC pipeline."""
     try:
-        download_and_process_blob()
+        run_once()
     except Exception as e:
         log_error(f" Error in main(): {str(e)}")
 
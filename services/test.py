@@ -18,8 +18,6 @@ def list_blobs():
     except Exception as e:
         print(f"Error listing blobs: {str(e)}")
 
-list_blobs()
-
 def upload_to_blob(data):
     try:
         file_path = "cdc_changes.json"
@@ -37,4 +35,6 @@ def upload_to_blob(data):
     except Exception as e:
         print(f"Azure Blob upload error: {str(e)}")
 
-upload_to_blob([{"id": 1, "name": "Test"}])
+if __name__ == "__main__":
+    list_blobs()
+    upload_to_blob([{"id": 1, "name": "Test"}])
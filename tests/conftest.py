@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# utils.logger opens logs/ relative to the working directory on import; keep test runs out of the tree
+os.chdir(tempfile.mkdtemp(prefix="cdc_tests_"))
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from utils.leases import SqliteLeaseStore, TableLeases
+
+TABLES = ["dbo.a", "dbo.b", "dbo.c", "dbo.d"]
+
+@pytest.fixture
+def store(tmp_path):
+    store = SqliteLeaseStore(str(tmp_path / "leases.db"))
+    yield store
+    store.close()
+
+def owners(store):
+    return {resource.rsplit("/", 1)[1]: owner for resource, owner in store.active("publisher/tables/").items()}
+
+def test_lease_is_exclusive_until_released(store):
+    assert store.acquire("r", "w1", 30)
+    assert not store.acquire("r", "w2", 30)
+    assert not store.renew("r", "w2", 30)
+    assert store.renew("r", "w1", 30)
+
+    store.release("r", "w2")  # Not the owner: no effect
+    assert store.active() == {"r": "w1"}
+    store.release("r", "w1")
+    assert store.acquire("r", "w2", 30)
+
+def test_expired_lease_can_be_taken_over(store):
+    assert store.acquire("r", "w1", 0.1)
+    time.sleep(0.2)
+    assert store.active() == {}
+    assert not store.renew("r", "w1", 30)
+    assert store.acquire("r", "w2", 30)
+
+def test_claim_rebalances_shares_when_a_worker_joins(store):
+    first = TableLeases(store, "publisher", "w1")
+    second = TableLeases(store, "publisher", "w2")
+
+    assert first.claim(TABLES) == TABLES
+    assert second.claim(TABLES) == []  # Every table is still leased to w1
+
+    kept = first.claim(TABLES)  # Two live workers: w1 releases its surplus
+    assert len(kept) == 2
+    taken = second.claim(TABLES)
+    assert sorted(kept + taken) == TABLES
+
+    assert first.claim(TABLES) == kept  # Assignments stay stable
+    assert second.claim(TABLES) == taken
+    assert owners(store) == {**{table: "w1" for table in kept}, **{table: "w2" for table in taken}}
+
+def test_claim_releases_tables_that_are_gone(store):
+    worker = TableLeases(store, "publisher", "w1")
+    assert worker.claim(TABLES) == TABLES
+    assert worker.claim(TABLES[:2]) == TABLES[:2]
+    assert sorted(owners(store)) == TABLES[:2]
+
+def test_stopped_worker_loses_its_tables_after_the_ttl(store):
+    stalled = TableLeases(store, "publisher", "w1", ttl=0.2)
+    survivor = TableLeases(store, "publisher", "w2")
+    assert stalled.claim(TABLES) == TABLES
+    assert survivor.claim(TABLES) == []
+
+    time.sleep(0.3)  # w1 stops heartbeating
+    assert survivor.claim(TABLES) == TABLES
+    assert owners(store) == {table: "w2" for table in TABLES}
+
+    stalled.heartbeat()  # w1 comes back: its renewals fail and it drops the tables
+    assert stalled.held == set()
+    assert stalled.claim(TABLES) == []
+
+def test_heartbeat_thread_keeps_leases_alive(store):
+    worker = TableLeases(store, "publisher", "w1", ttl=0.3).start()
+    other = TableLeases(store, "publisher", "w2")
+    try:
+        assert worker.claim(TABLES) == TABLES
+        time.sleep(0.5)  # Longer than the ttl, renewed every ttl/3
+        assert owners(store) == {table: "w1" for table in TABLES}
+        assert other.claim(TABLES) == []
+    finally:
+        worker.stop()
+
+def test_stop_releases_leases_for_immediate_takeover(store):
+    leaving = TableLeases(store, "publisher", "w1").start()
+    staying = TableLeases(store, "publisher", "w2")
+    assert leaving.claim(TABLES) == TABLES
+    assert staying.claim(TABLES) == []
+
+    leaving.stop()
+    assert owners(store) == {}
+    assert store.active("publisher/workers/") == {"publisher/workers/w2": "w2"}
+    assert staying.claim(TABLES) == TABLES  # No wait for the ttl
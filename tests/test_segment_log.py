@@ -0,0 +1,92 @@
+import os
+
+from utils.segment_log import RECORD_HEADER, SegmentLog
+
+def segment_files(log):
+    return sorted(os.listdir(os.path.join(log.directory, "segments")))
+
+def keyed(records):
+    return [(record.offset, None if record.key is None else bytes(record.key), bytes(record.value)) for record in records]
+
+def values(records):
+    return [(record.offset, bytes(record.value)) for record in records]
+
+def test_torn_tail_record_is_ignored_and_truncated(tmp_path):
+    log = SegmentLog(str(tmp_path), fsync=False)
+    log.append_batch([b"a", b"b", b"c"])
+    path = os.path.join(log.directory, "segments", segment_files(log)[-1])
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(RECORD_HEADER.pack(3, 0xFFFFFFFF, 100, 0) + b"partial")  # Crash in the middle of a write
+
+    reopened = SegmentLog(str(tmp_path), fsync=False)
+    assert reopened.end_offset() == 3
+    assert values(reopened.read(0)) == [(0, b"a"), (1, b"b"), (2, b"c")]
+
+    assert reopened.append(b"d") == 3
+    assert os.path.getsize(path) == intact + RECORD_HEADER.size + 1
+    assert values(reopened.read(0)) == [(0, b"a"), (1, b"b"), (2, b"c"), (3, b"d")]
+    reopened.close()
+    log.close()
+
+def test_corrupt_tail_record_fails_its_checksum(tmp_path):
+    log = SegmentLog(str(tmp_path), fsync=False)
+    log.append_batch([b"first", b"second"])
+    log.close()
+    path = os.path.join(str(tmp_path), "segments", segment_files(log)[-1])
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"X")  # "seconX" no longer matches the record's crc32
+
+    reopened = SegmentLog(str(tmp_path), fsync=False)
+    assert reopened.end_offset() == 1
+    assert values(reopened.read(0)) == [(0, b"first")]
+    assert reopened.append(b"replacement") == 1
+    assert values(reopened.read(0)) == [(0, b"first"), (1, b"replacement")]
+    reopened.close()
+
+def test_tail_advances_across_segments_written_by_another_instance(tmp_path):
+    reader = SegmentLog(str(tmp_path), segment_bytes=64, fsync=False)
+    writer = SegmentLog(str(tmp_path), segment_bytes=64, fsync=False)
+    assert reader.end_offset() == 0
+
+    writer.append_batch([b"x" * 20 for _ in range(2)])
+    assert reader.end_offset() == 2
+    for i in range(2, 10):
+        assert writer.append(f"value-{i}".encode()) == i
+
+    assert len(segment_files(writer)) > 1
+    assert reader.end_offset() == 10  # Follows the writer into the segments it rolled to
+    assert reader.append(b"last") == 10
+    assert writer.end_offset() == 11
+    assert [record.offset for record in reader.read(0, max_records=100)] == list(range(11))
+    assert [record.offset for record in reader.read(7, max_records=2)] == [7, 8]
+    reader.close()
+    writer.close()
+
+def test_compaction_keeps_latest_record_per_key(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=1, fsync=False)  # One record per segment
+    log.append(b"v1", key="a")
+    log.append(b"v1", key="b")
+    log.append(b"unkeyed")
+    log.append(b"v2", key="a")
+    log.append(b"v3", key="a")
+    assert len(segment_files(log)) == 5
+
+    assert log.compact() == 2  # The earlier "a" records
+    assert keyed(log.read(0)) == [(1, b"b", b"v1"), (2, None, b"unkeyed"), (4, b"a", b"v3")]
+    assert log.start_offset() == 1
+    assert log.end_offset() == 5
+
+    assert log.append(b"v2", key="b") == 5
+    assert log.compact() == 1  # "b" v1 is superseded once its newer record exists
+    assert keyed(log.read(0)) == [(2, None, b"unkeyed"), (4, b"a", b"v3"), (5, b"b", b"v2")]
+    log.close()
+
+def test_compaction_leaves_the_active_segment_alone(tmp_path):
+    log = SegmentLog(str(tmp_path), fsync=False)
+    log.append(b"v1", key="a")
+    log.append(b"v2", key="a")
+    assert log.compact() == 0
+    assert keyed(log.read(0)) == [(0, b"a", b"v1"), (1, b"a", b"v2")]
+    log.close()
@@ -0,0 +1,133 @@
+import threading
+import time
+
+from utils.columnar import ColumnarBatch
+from utils.metrics import BATCH_BUDGET_ROWS
+
+class BatchSizer:
+    """
+    Per-table row, byte and age budgets tuned to keep replication lag under `target_lag` seconds.
+
+    Each table's load time is modelled as a fixed overhead plus a cost per row, fitted by
+    exponentially weighted least squares over the observed loads, so recent loads count most.
+    A batch may take up to `load_share` of the target to load, which sets the row budget:
+    tables with a small per-row cost get large, efficient batches, while a table's age
+    budget is whatever the target leaves after its predicted load time. The initial budgets
+    apply until a table's first load.
+    """
+
+    def __init__(self, target_lag, min_rows=1000, max_rows=1000000, max_bytes=None,
+                 initial_rows=50000, initial_seconds=30, min_seconds=1, load_share=0.5, decay=0.8):
+        self.target_lag = target_lag
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.initial_rows = initial_rows
+        self.initial_seconds = min(initial_seconds, target_lag)
+        self.min_seconds = min_seconds
+        self.load_share = load_share
+        self.decay = decay
+        self._stats = {}  # table -> [weight, w*rows, w*seconds, w*rows^2, w*rows*seconds, bytes per row]
+        self._lock = threading.Lock()
+
+    def _model(self, stats):
+        """Return (overhead seconds, seconds per row), or None without enough data."""
+        w, wx, wy, wxx, wxy, _ = stats
+        if not wx or wy <= 0:
+            return None
+        denominator = w * wxx - wx * wx
+        slope = (w * wxy - wx * wy) / denominator if denominator > 1e-9 * w * wxx else 0
+        if slope <= 0:
+            # Loads of one size, or load time did not grow with rows: size by the average cost per row
+            return 0.0, wy / wx
+        return max((wy - slope * wx) / w, 0.0), slope
+
+    def budget(self, table):
+        """Return the (rows, bytes, seconds) limits for a table's next batch; bytes is None when unbounded."""
+        with self._lock:
+            stats = self._stats.get(table)
+            model = self._model(stats) if stats else None
+            bytes_per_row = stats[5] if stats else None
+
+        if model is None:
+            rows, seconds = self.initial_rows, self.initial_seconds
+        else:
+            overhead, per_row = model
+            rows = int((self.target_lag * self.load_share - overhead) / per_row)
+            rows = min(max(rows, self.min_rows), self.max_rows)
+            seconds = min(max(self.target_lag - (overhead + per_row * rows), self.min_seconds), self.target_lag)
+
+        max_bytes = self.max_bytes
+        if max_bytes and bytes_per_row:
+            rows = min(rows, max(int(max_bytes / bytes_per_row), 1))
+        BATCH_BUDGET_ROWS.set(rows, table=table)
+        return rows, max_bytes, seconds
+
+    def observe(self, table, rows, nbytes, seconds):
+        """Record one load of `rows` rows (`nbytes` bytes) that took `seconds`."""
+        if rows <= 0:
+            return
+        with self._lock:
+            stats = self._stats.get(table)
+            if stats is None:
+                stats = self._stats[table] = [0.0, 0.0, 0.0, 0.0, 0.0, None]
+            for i in range(5):
+                stats[i] *= self.decay
+            stats[0] += 1
+            stats[1] += rows
+            stats[2] += seconds
+            stats[3] += rows * rows
+            stats[4] += rows * seconds
+            per_row = nbytes / rows
+            stats[5] = per_row if stats[5] is None else self.decay * stats[5] + (1 - self.decay) * per_row
+
+class TableBuffers:
+    """
+    Per-table bounded buffers of ColumnarBatch chunks.
+    A table's chunks are concatenated and handed to `flush(table, batch)` as soon
+    as its buffer holds `max_rows` rows or `max_bytes` bytes, or its oldest chunk
+    is `max_seconds` old. With a BatchSizer, the limits come from its per-table
+    budgets instead, and every flush is timed and fed back to it.
+    """
+
+    def __init__(self, flush, max_rows=50000, max_seconds=30, max_bytes=None, sizer=None):
+        self._flush = flush
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self._buffers = {}  # table -> [batches, buffered rows, buffered bytes, first added at]
+
+    def add(self, table, batch):
+        """Buffer one batch, flushing the table if a threshold is reached."""
+        buffer = self._buffers.setdefault(table, [[], 0, 0, time.monotonic()])
+        buffer[0].append(batch)
+        buffer[1] += len(batch)
+        buffer[2] += batch.nbytes()
+        if self.sizer is not None:
+            max_rows, max_bytes, max_seconds = self.sizer.budget(table)
+        else:
+            max_rows, max_bytes, max_seconds = self.max_rows, self.max_bytes, self.max_seconds
+        if (
+            buffer[1] >= max_rows
+            or (max_bytes and buffer[2] >= max_bytes)
+            or time.monotonic() - buffer[3] >= max_seconds
+        ):
+            self.flush(table)
+
+    def flush(self, table):
+        """Hand a table's buffered rows to the sink as one batch."""
+        batches, rows, nbytes, _ = self._buffers.pop(table, ([], 0, 0, None))
+        if rows:
+            started = time.perf_counter()
+            self._flush(table, ColumnarBatch.concat(batches))
+            if self.sizer is not None:
+                self.sizer.observe(table, rows, nbytes, time.perf_counter() - started)
+
+    def flush_all(self):
+        for table in list(self._buffers):
+            self.flush(table)
+
+    def pending(self):
+        """Return the number of buffered rows across all tables."""
+        return sum(buffer[1] for buffer in self._buffers.values())
@@ -0,0 +1,453 @@
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.logger import log_info
+from utils.columnar import ColumnarBatch
+from utils.codec import get_codec
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional; gzip is always available
+    zstandard = None
+
+BATCH_PREFIX = "cdc"
+EXTENSIONS = {"gzip": "gz", "zstd": "zst"}
+# Object body per payload codec: NDJSON lines, or length-prefixed binary frames
+PAYLOAD_EXTENSIONS = {"json": "ndjson", "binary": "cdcb"}
+BLOCK_BYTES = 4 * 1024 * 1024
+# Rows per ColumnarBatch yielded while streaming a batch object
+STREAM_BATCH_ROWS = 10000
+
+class BlobExistsError(Exception):
+    """Raised when writing a batch object whose name is already taken."""
+
+class LocalBlobStore:
+    """Filesystem stand-in for an Azure container; metadata is kept in `<name>.meta.json` sidecars."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def upload_stream(self, name, blocks, get_metadata, max_concurrency=1):
+        """Write blocks to a temporary file and publish it under `name` once complete."""
+        path = self._path(name)
+        if os.path.exists(path):
+            raise BlobExistsError(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            for block in blocks:
+                f.write(block)
+        with open(f"{path}.meta.json", "w") as f:
+            json.dump(get_metadata(), f)
+        os.replace(tmp_path, path)
+
+    def download_stream(self, name, chunk_bytes=BLOCK_BYTES):
+        """Return (chunk iterator, metadata) for reading an object incrementally."""
+        def chunks():
+            with open(self._path(name), "rb") as f:
+                while True:
+                    chunk = f.read(chunk_bytes)
+                    if not chunk:
+                        return
+                    yield chunk
+        return chunks(), self.get_metadata(name)
+
+    def move(self, name, new_name):
+        """Move an object and its metadata to `new_name`; if that already exists, `name` is just removed."""
+        path, new_path = self._path(name), self._path(new_name)
+        if os.path.exists(new_path):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(path, new_path)
+        if os.path.exists(f"{path}.meta.json"):
+            os.replace(f"{path}.meta.json", f"{new_path}.meta.json")
+
+    def get_metadata(self, name):
+        try:
+            with open(f"{self._path(name)}.meta.json", "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def list_prefixes(self, prefix):
+        directory = self._path(prefix.rstrip("/"))
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            f"{prefix}{entry}/" for entry in os.listdir(directory)
+            if os.path.isdir(os.path.join(directory, entry))
+        )
+
+    def list(self, prefix, start_after=None):
+        directory = self._path(prefix.rstrip("/"))
+        if not os.path.isdir(directory):
+            return []
+        names = (
+            f"{prefix}{entry}" for entry in os.listdir(directory)
+            if not entry.endswith((".meta.json", ".tmp"))
+        )
+        return sorted(name for name in names if start_after is None or name > start_after)
+
+class AzureBlobStore:
+    """Batch object store backed by an Azure Blob Storage container."""
+
+    def __init__(self, connection_string, container_name):
+        from azure.storage.blob import BlobServiceClient
+        self.service_client = BlobServiceClient.from_connection_string(
+            connection_string, max_single_get_size=BLOCK_BYTES, max_chunk_get_size=BLOCK_BYTES
+        )
+        self.container_client = self.service_client.get_container_client(container_name)
+
+    def upload_stream(self, name, blocks, get_metadata, max_concurrency=4):
+        """
+        Stage blocks concurrently as they are produced and commit them as one blob.
+        At most `max_concurrency * 2` blocks are in memory at once.
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import BlobBlock
+
+        blob_client = self.container_client.get_blob_client(name)
+        if blob_client.exists():
+            raise BlobExistsError(name)  # Checked up front so a rewritten batch is not uploaded again
+        in_flight = threading.BoundedSemaphore(max_concurrency * 2)
+        block_ids = []
+        futures = []
+
+        def stage(block_id, block):
+            try:
+                blob_client.stage_block(block_id, block, validate_content=True)
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="blob-block") as executor:
+            for i, block in enumerate(blocks):
+                block_id = base64.b64encode(f"{i:08d}".encode()).decode()
+                block_ids.append(block_id)
+                in_flight.acquire()
+                futures.append(executor.submit(stage, block_id, block))
+            for future in futures:
+                future.result()
+
+        try:
+            return blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in block_ids],
+                metadata=get_metadata(),
+                match_condition=MatchConditions.IfMissing
+            )
+        except ResourceExistsError:
+            raise BlobExistsError(name)
+
+    def download_stream(self, name):
+        """Return (chunk iterator, metadata) for reading an object incrementally, BLOCK_BYTES at a time."""
+        downloader = self.container_client.download_blob(name)
+        return downloader.chunks(), downloader.properties.metadata or {}
+
+    def get_metadata(self, name):
+        return self.container_client.get_blob_client(name).get_blob_properties().metadata or {}
+
+    def move(self, name, new_name):
+        """Copy an object (with its metadata) to `new_name` within the container, then delete it."""
+        source = self.container_client.get_blob_client(name)
+        target = self.container_client.get_blob_client(new_name)
+        if not target.exists():
+            target.start_copy_from_url(source.url)
+            status = target.get_blob_properties().copy.status
+            while status == "pending":
+                time.sleep(0.2)
+                status = target.get_blob_properties().copy.status
+            if status != "success":
+                raise IOError(f"Copying {name} to {new_name} ended with status {status}")
+        source.delete_blob()
+
+    def list_prefixes(self, prefix):
+        return sorted(
+            item.name for item in self.container_client.walk_blobs(name_starts_with=prefix, delimiter="/")
+            if item.name.endswith("/")
+        )
+
+    def list(self, prefix, start_after=None):
+        names = (blob.name for blob in self.container_client.list_blobs(name_starts_with=prefix))
+        return sorted(name for name in names if start_after is None or name > start_after)
+
+def get_blob_store(config):
+    """Return the batch store for AZURE_STORAGE_CONFIG; a "local_path" selects the filesystem stand-in."""
+    if config.get("local_path"):
+        return LocalBlobStore(config["local_path"])
+    return AzureBlobStore(config["connection_string"], config["container_name"])
+
+def iter_compressed(chunks, codec):
+    """Compress a stream of byte chunks incrementally."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip member
+
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def iter_blocks(chunks, block_bytes=BLOCK_BYTES):
+    """Regroup a stream of byte chunks into blocks of roughly `block_bytes`."""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= block_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+def iter_decompressed(chunks, codec):
+    """Decompress a stream of byte chunks incrementally."""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = zlib.decompressobj(31)  # gzip, with its CRC checked at the end of the member
+
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if codec != "zstd":
+        data = decompressor.flush()
+        if data:
+            yield data
+        if not decompressor.eof:
+            raise IOError("Truncated gzip stream")
+
+def iter_lines(chunks):
+    """Split a stream of byte chunks into lines without holding more than one chunk."""
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if pending:
+        yield pending
+
+def iter_frames(chunks):
+    """Split a stream of byte chunks into uint32 length-prefixed frames."""
+    pending = bytearray()
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= 4:
+            (size,) = struct.unpack_from("<I", pending)
+            if len(pending) < 4 + size:
+                break
+            yield bytes(pending[4:4 + size])
+            del pending[:4 + size]
+    if pending:
+        raise IOError("Truncated batch frame")
+
+def codec_from_name(name):
+    """Return the compression codec implied by a batch object's extension."""
+    return "zstd" if name.endswith(".zst") else "gzip"
+
+def payload_codec_from_name(name):
+    """Return the payload codec implied by a batch object's extension."""
+    return "binary" if f".{PAYLOAD_EXTENSIONS['binary']}." in name else "json"
+
+def table_prefix(table):
+    return f"{BATCH_PREFIX}/{table}/"
+
+def archive_name(name, archive_prefix):
+    """Return the name a loaded batch object is moved to: `<archive_prefix>/<table>/<file>`."""
+    return f"{archive_prefix}/{name[len(BATCH_PREFIX) + 1:]}"
+
+def batch_digest(batch):
+    """Short hash of a batch's columns and the change identity (LSN, sequence value, operation) of each row."""
+    digest = hashlib.sha256(json.dumps(batch.columns).encode("utf-8"))
+    for column in ("__$start_lsn", "__$seqval", "__$operation"):
+        if column in batch.columns:
+            digest.update(repr(batch.column(column)).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def batch_blob_name(batch, codec="gzip", payload_codec="json"):
+    """
+    Name a batch object `cdc/<table>/<first lsn>_<last lsn>_<chunk>_<digest>.<ndjson|cdcb>.<ext>`.
+    LSNs are fixed-width hex and `chunk` numbers the batches of one extraction window, so names
+    sort in change order within a table. The name depends only on the batch's contents, so a
+    batch published again after a failed poll maps to the object already written.
+    """
+    first_lsn, last_lsn = batch.first("__$start_lsn"), batch.last("__$start_lsn")
+    first = first_lsn[2:] if first_lsn.lower().startswith("0x") else first_lsn
+    last = last_lsn[2:] if last_lsn.lower().startswith("0x") else last_lsn
+    chunk = batch.metadata.get("window_chunk", 0)
+    return (
+        f"{table_prefix(batch.table)}{first}_{last}_{chunk:06d}_{batch_digest(batch)}"
+        f".{PAYLOAD_EXTENSIONS[payload_codec]}.{EXTENSIONS[codec]}"
+    )
+
+def lsn_fence_name(table, lsn):
+    """
+    Return a name that sorts after every batch object of `table` whose first LSN is at or
+    before `lsn` ('0x...') and before every later one, for use as a blob watermark.
+    """
+    digits = lsn[2:] if lsn.lower().startswith("0x") else lsn
+    return f"{table_prefix(table)}{digits.upper()}_~"  # "~" sorts after the hex digits that follow "_"
+
+def json_default(value):
+    """Encode values json cannot serialize natively, without copying the record."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, bytes):
+        return f"0x{value.hex().upper()}"
+    return str(value)
+
+def iter_ndjson(records):
+    """Encode records one at a time as compact newline-delimited JSON lines."""
+    encode = json.JSONEncoder(default=json_default, separators=(",", ":")).encode
+    for record in records:
+        yield (encode(record) + "\n").encode("utf-8")
+
+def iter_batch_ndjson(batch):
+    """
+    Encode a ColumnarBatch as NDJSON: a header line with the table, columns and
+    metadata, then one JSON array of values per row, so column names are written once.
+    """
+    encode = json.JSONEncoder(default=json_default, separators=(",", ":")).encode
+    yield (encode(batch.header()) + "\n").encode("utf-8")
+    for row in zip(*batch.formatted_data()):
+        yield (encode(row) + "\n").encode("utf-8")
+
+def iter_binary_frames(batch, frame_rows=STREAM_BATCH_ROWS):
+    """Encode a ColumnarBatch as length-prefixed binary frames of at most `frame_rows` rows."""
+    codec = get_codec("binary")
+    for start in range(0, len(batch), frame_rows):
+        frame = codec.encode(batch.slice(start, start + frame_rows))
+        yield struct.pack("<I", len(frame)) + frame
+
+def iter_payload(batch, payload_codec="json"):
+    if payload_codec == "binary":
+        return iter_binary_frames(batch)
+    return iter_batch_ndjson(batch)
+
+def batch_metadata(batch, sha256):
+    return {"sha256": sha256, "records": str(len(batch)), "table": batch.table}
+
+def put_batch(store, batch, codec="gzip", max_concurrency=4, payload_codec="json"):
+    """
+    Stream one ColumnarBatch into an immutable, compressed object; returns the object name.
+    Rows are encoded and compressed straight into upload blocks, with no temp file or copy.
+    """
+    name = batch_blob_name(batch, codec, payload_codec)
+    sha256 = hashlib.sha256()
+    size = 0
+
+    def hashed(blocks):
+        nonlocal size
+        for block in blocks:
+            sha256.update(block)
+            size += len(block)
+            yield block
+
+    blocks = hashed(iter_blocks(iter_compressed(iter_payload(batch, payload_codec), codec)))
+    store.upload_stream(name, blocks, lambda: batch_metadata(batch, sha256.hexdigest()), max_concurrency)
+
+    log_info(f"Uploaded {len(batch)} records to {name} ({size} bytes, sha256 {sha256.hexdigest()[:12]})", max_per_minute=60)
+    return name
+
+def encode_batch(batch, codec="gzip", payload_codec="json"):
+    """
+    Encode one ColumnarBatch ahead of upload, for pipelines that overlap encoding with I/O.
+    Returns (object name, compressed blocks, metadata).
+    """
+    name = batch_blob_name(batch, codec, payload_codec)
+    blocks = list(iter_blocks(iter_compressed(iter_payload(batch, payload_codec), codec)))
+    sha256 = hashlib.sha256()
+    for block in blocks:
+        sha256.update(block)
+    return name, blocks, batch_metadata(batch, sha256.hexdigest())
+
+def upload_encoded(store, name, blocks, metadata, max_concurrency=4):
+    """Upload a batch produced by encode_batch()."""
+    store.upload_stream(name, iter(blocks), lambda: metadata, max_concurrency)
+    log_info(
+        f"Uploaded {metadata['records']} records to {name} ({sum(map(len, blocks))} bytes, sha256 {metadata['sha256'][:12]})",
+        max_per_minute=60
+    )
+    return name
+
+def stream_batch(store, name, batch_rows=STREAM_BATCH_ROWS):
+    """
+    Download, decompress and parse one batch object incrementally, yielding
+    ColumnarBatch chunks of at most `batch_rows` rows (binary objects yield their
+    frames as written). Objects written before the columnar layout (one record
+    dict per line) are converted on the fly.
+    The sha256 is checked once the stream ends; IOError is raised on mismatch.
+    """
+    chunks, metadata = store.download_stream(name)
+    sha256 = hashlib.sha256()
+
+    def hashed():
+        for chunk in chunks:
+            sha256.update(chunk)
+            yield chunk
+
+    if payload_codec_from_name(name) == "binary":
+        codec = get_codec("binary")
+        for frame in iter_frames(iter_decompressed(hashed(), codec_from_name(name))):
+            yield codec.decode(frame)
+        if metadata.get("sha256") and sha256.hexdigest() != metadata["sha256"]:
+            raise IOError(f"Checksum mismatch for {name}")
+        return
+
+    header = None
+    pending = []
+
+    def flush():
+        if header is not None:
+            data = [list(values) for values in zip(*pending)] or [[] for _ in header["columns"]]
+            return [ColumnarBatch.from_dict({**header, "data": data})]
+        return ColumnarBatch.from_records(pending)
+
+    for i, line in enumerate(iter_lines(iter_decompressed(hashed(), codec_from_name(name)))):
+        value = json.loads(line)
+        if i == 0 and isinstance(value, dict) and "columns" in value:
+            header = value
+            continue
+        pending.append(value)
+        if len(pending) >= batch_rows:
+            yield from flush()
+            pending = []
+
+    if pending:
+        yield from flush()
+
+    expected = metadata.get("sha256")
+    if expected and sha256.hexdigest() != expected:
+        raise IOError(f"Checksum mismatch for {name}")
+
+def read_batch(config, name):
+    """
+    Download and decode a whole batch object into a list of ColumnarBatch chunks.
+    Takes the store config rather than a store, so it can run in a worker process.
+    """
+    return list(stream_batch(get_blob_store(config), name))
@@ -0,0 +1,247 @@
+import binascii
+import datetime
+import decimal
+import uuid
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow export is optional
+    pa = None
+
+SOURCE_TABLE = "_source_table"
+OPERATION = "__$operation"
+OP_BEFORE_IMAGE = 3  # Update before-image; never the final state of a row
+# Kinds written as strings by formatted_data() and parsed back by parse_column()
+TEMPORAL_KINDS = {"datetime", "datetimeoffset", "date", "time"}
+PARSERS = {
+    "datetime": datetime.datetime.fromisoformat,
+    "datetimeoffset": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "decimal": decimal.Decimal,
+    "uuid": uuid.UUID,
+}
+# Approximate encoded size per value of fixed-width kinds, used by ColumnarBatch.nbytes()
+KIND_BYTES = {
+    "null": 0, "bool": 1, "int": 8, "float": 8, "decimal": 17, "datetime": 8,
+    "datetimeoffset": 10, "date": 4, "time": 5, "uuid": 16,
+}
+NBYTES_SAMPLE = 64
+
+def encode_binary_column(values):
+    """
+    Hex-encode a column of varbinary values as '0x...' strings.
+    Fixed-width columns (LSNs, seqvals) are encoded with one hexlify call over the whole column.
+    """
+    present = [value for value in values if value is not None]
+    width = len(present[0]) if present else 0
+    if present and len(present) == len(values) and all(len(value) == width for value in present):
+        encoded = binascii.hexlify(b"".join(values)).decode("ascii").upper()
+        step = width * 2
+        return [f"0x{encoded[i:i + step]}" for i in range(0, len(encoded), step)]
+    return [None if value is None else f"0x{value.hex().upper()}" for value in values]
+
+def format_temporal_column(values):
+    """Format a column of date/time values as ISO-8601 strings."""
+    return [None if value is None else value.isoformat() for value in values]
+
+def parse_column(kind, values):
+    """Turn a column formatted by formatted_data() back into typed values."""
+    parse = PARSERS.get(kind)
+    if parse is None:
+        return values
+    return [None if value is None else parse(value) for value in values]
+
+def column_kind(values):
+    """Classify a column by the SQL value kind of its first non-NULL value."""
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, (bytes, bytearray)):
+            return "binary"
+        if isinstance(value, bool):
+            return "bool"
+        if isinstance(value, int):
+            return "int"
+        if isinstance(value, float):
+            return "float"
+        if isinstance(value, decimal.Decimal):
+            return "decimal"
+        if isinstance(value, datetime.datetime):
+            return "datetimeoffset" if value.tzinfo else "datetime"
+        if isinstance(value, datetime.date):
+            return "date"
+        if isinstance(value, datetime.time):
+            return "time"
+        if isinstance(value, uuid.UUID):
+            return "uuid"
+        return "str"
+    return "null"
+
+class ColumnarBatch:
+    """
+    A batch of CDC changes from one table stored column by column.
+    Column names are kept once in `columns` and values in one list per column
+    in `data`, so rows carry no per-record dict or repeated keys. `metadata`
+    holds batch-level facts; its "types" entry maps columns to SQL value kinds
+    (see column_kind) so typed values survive text encodings.
+    """
+
+    __slots__ = ("table", "columns", "data", "metadata")
+
+    def __init__(self, table, columns, data, metadata=None):
+        self.table = table
+        self.columns = list(columns)
+        self.data = data
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_rows(cls, table, columns, rows, metadata=None):
+        """Transpose cursor rows into columns, hex-encoding varbinary columns as whole columns."""
+        data = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+        types = {}
+        for i, values in enumerate(data):
+            kind = column_kind(values)
+            if kind == "binary":
+                data[i] = encode_binary_column(values)
+            if kind != "null":
+                types[columns[i]] = kind
+        return cls(table, columns, data, {**(metadata or {}), "types": types})
+
+    @classmethod
+    def from_records(cls, records):
+        """Build one batch per source table from legacy record dicts."""
+        by_table = {}
+        for record in records:
+            by_table.setdefault(record.get(SOURCE_TABLE), []).append(record)
+
+        batches = []
+        for table, table_records in by_table.items():
+            columns = list(dict.fromkeys(col for record in table_records for col in record if col != SOURCE_TABLE))
+            data = [[record.get(col) for record in table_records] for col in columns]
+            batches.append(cls(table, columns, data))
+        return batches
+
+    @classmethod
+    def concat(cls, batches):
+        """Concatenate batches of the same table, aligning columns by name."""
+        if len(batches) == 1:
+            return batches[0]
+        columns = list(dict.fromkeys(col for batch in batches for col in batch.columns))
+        data = [[] for _ in columns]
+        types = {}
+        for batch in batches:
+            size = len(batch)
+            index = {col: i for i, col in enumerate(batch.columns)}
+            for j, col in enumerate(columns):
+                data[j].extend(batch.data[index[col]] if col in index else [None] * size)
+            types.update(batch.types)
+        return cls(batches[0].table, columns, data, {**batches[-1].metadata, "types": types})
+
+    def __len__(self):
+        return len(self.data[0]) if self.data else 0
+
+    @property
+    def types(self):
+        return self.metadata.get("types", {})
+
+    def kind(self, i):
+        """Return the SQL value kind of column `i`, from metadata or, failing that, its values."""
+        return self.types.get(self.columns[i]) or column_kind(self.data[i])
+
+    def column(self, name):
+        return self.data[self.columns.index(name)]
+
+    def nbytes(self):
+        """
+        Approximate payload size in bytes: a fixed width per value for fixed-width kinds,
+        and the average length of a sample of values for text and binary columns.
+        """
+        count = len(self)
+        total = 0
+        for i, values in enumerate(self.data):
+            kind = self.kind(i)
+            if kind in KIND_BYTES:
+                total += KIND_BYTES[kind] * count
+                continue
+            sample = values[:NBYTES_SAMPLE]
+            if sample:
+                sizes = (len(value) if isinstance(value, (str, bytes)) else len(str(value)) for value in sample if value is not None)
+                total += sum(sizes) * count // len(sample)
+        return total
+
+    def first(self, name):
+        return self.column(name)[0]
+
+    def last(self, name):
+        return self.column(name)[-1]
+
+    def select(self, columns):
+        """Return a batch with only `columns`, sharing the underlying column lists."""
+        index = {col: i for i, col in enumerate(self.columns)}
+        return ColumnarBatch(self.table, columns, [self.data[index[col]] for col in columns], self.metadata)
+
+    def drop(self, columns):
+        return self.select([col for col in self.columns if col not in columns])
+
+    def slice(self, start, stop):
+        return ColumnarBatch(self.table, self.columns, [values[start:stop] for values in self.data], self.metadata)
+
+    def take(self, indices):
+        """Return a batch with the rows at `indices`, in that order."""
+        return ColumnarBatch(self.table, self.columns, [[values[i] for i in indices] for values in self.data], self.metadata)
+
+    def compact(self, key_columns):
+        """
+        Collapse each key's changes to its last one, dropping update before-images.
+        The surviving rows keep the LSN order of their final change, so the batch
+        still applies in order: the last insert/update upserts, a last delete deletes.
+        """
+        operations = self.column(OPERATION)
+        keys = zip(*(self.column(col) for col in key_columns))
+        last = {}
+        for i, (key, operation) in enumerate(zip(keys, operations)):
+            if operation != OP_BEFORE_IMAGE:
+                last[key] = i
+        return self.take(sorted(last.values()))
+
+    def rows(self):
+        """Iterate row tuples in column order."""
+        return zip(*self.data)
+
+    def records(self):
+        """Materialize legacy record dicts; only for callers that still need them."""
+        return [{SOURCE_TABLE: self.table, **dict(zip(self.columns, row))} for row in self.rows()]
+
+    def formatted_data(self):
+        """Return column lists with temporal, decimal and uuid columns converted to strings, column by column."""
+        formatted = []
+        for i, values in enumerate(self.data):
+            kind = self.kind(i)
+            if kind in TEMPORAL_KINDS:
+                values = format_temporal_column(values)
+            elif kind in ("decimal", "uuid"):
+                values = [None if value is None else str(value) for value in values]
+            formatted.append(values)
+        return formatted
+
+    def header(self):
+        return {"table": self.table, "columns": self.columns, "metadata": self.metadata}
+
+    def to_dict(self):
+        """Return a JSON-serializable representation."""
+        return {**self.header(), "data": self.formatted_data()}
+
+    @classmethod
+    def from_dict(cls, payload):
+        """Rebuild a batch from to_dict() output, restoring typed values from the "types" metadata."""
+        metadata = payload.get("metadata") or {}
+        types = metadata.get("types", {})
+        data = [parse_column(types.get(col), values) for col, values in zip(payload["columns"], payload["data"])]
+        return cls(payload["table"], payload["columns"], data, metadata)
+
+    def to_arrow(self):
+        """Return the batch as a pyarrow.Table (requires pyarrow)."""
+        if pa is None:
+            raise RuntimeError("Arrow export requires the 'pyarrow' package")
+        return pa.table(dict(zip(self.columns, self.data)))
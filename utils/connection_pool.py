@@ -0,0 +1,141 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.logger import log_info, log_error
+
+class ConnectionPool:
+    """
+    Thread-safe pool of reusable database connections.
+    Connections are created lazily by `connect` up to `max_size` and handed
+    back to the pool after use instead of being closed.
+
+    If `validate` is given, a connection idle for longer than `validate_after`
+    seconds is health-checked before it is handed out, and with
+    `keepalive_interval` a background thread pings idle connections so
+    sessions are not expired by the server between uses.
+    """
+
+    def __init__(self, connect, max_size=4, name="connection", validate=None,
+                 validate_after=60, keepalive_interval=None):
+        self.name = name
+        self._connect = connect
+        self._max_size = max_size
+        self._validate = validate
+        self._validate_after = validate_after
+        self._idle = []  # (connection, released at), most recently released last
+        self._created = 0
+        self._available = threading.Condition()  # Signalled when a connection is returned or capacity frees up
+        self._closed = threading.Event()
+
+        if validate and keepalive_interval:
+            threading.Thread(
+                target=self._keepalive_loop, args=(keepalive_interval,),
+                name=f"{name}-keepalive", daemon=True
+            ).start()
+
+    def acquire(self, timeout=None):
+        """
+        Borrow an idle connection, opening a new one if the pool is not yet full.
+        When the pool is full, wait until a connection is returned or discarded;
+        raises TimeoutError if none is available within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._available:
+                while not self._idle and self._created >= self._max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No {self.name} connection available within {timeout}s")
+                    self._available.wait(remaining)
+                if self._idle:
+                    conn, released_at = self._idle.pop()
+                else:
+                    self._created += 1
+                    conn = None
+
+            if conn is None:
+                return self._open()
+            if self._is_healthy(conn, released_at):
+                return conn
+            self.release(conn, discard=True)
+
+    def _open(self):
+        """Open a connection for a slot already counted in `_created`."""
+        try:
+            conn = self._connect()
+            if conn is None:
+                raise ConnectionError(f"Could not open {self.name} connection")
+        except BaseException:
+            with self._available:
+                self._created -= 1
+                self._available.notify()
+            raise
+        log_info(f"Opened {self.name} connection ({self._created}/{self._max_size})")
+        return conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable."""
+        with self._available:
+            if not discard and not self._closed.is_set():
+                self._idle.append((conn, time.monotonic()))
+                self._available.notify()
+                return
+            self._created -= 1
+            self._available.notify()
+        try:
+            conn.close()
+        except Exception as e:
+            log_error(f"Error closing {self.name} connection: {e}")
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a `with` block. It is returned however the
+        block exits, including when a generator holding it is closed; after an error it is
+        rolled back, and closed if that fails.
+        """
+        conn = self.acquire()
+        succeeded = False
+        try:
+            yield conn
+            succeeded = True
+        finally:
+            if succeeded:
+                self.release(conn)
+            else:
+                self.release(conn, discard=not self._rollback(conn))
+
+    def close_all(self):
+        """Close every idle connection held by the pool and stop the keep-alive thread."""
+        self._closed.set()
+        for conn, _ in self._drain_idle():
+            self.release(conn, discard=True)
+
+    def _drain_idle(self):
+        with self._available:
+            idle, self._idle = self._idle, []
+        return idle
+
+    def _is_healthy(self, conn, released_at):
+        """Health-check a connection that has been idle longer than `validate_after`."""
+        if not self._validate or time.monotonic() - released_at < self._validate_after:
+            return True
+        try:
+            return self._validate(conn)
+        except Exception as e:
+            log_error(f"Discarding unhealthy {self.name} connection: {e}")
+            return False
+
+    def _keepalive_loop(self, interval):
+        while not self._closed.wait(interval):
+            for conn, released_at in self._drain_idle():
+                self.release(conn, discard=not self._is_healthy(conn, float("-inf")))
+
+    def _rollback(self, conn):
+        """Roll back a connection after an error; returns False if it is broken."""
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
@@ -0,0 +1,239 @@
+import csv
+import datetime
+import decimal
+import gzip
+import io
+import re
+import threading
+
+class FakeSnowflakeCursor:
+    """Cursor of a FakeSnowflakeConnection; records statements instead of running them."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._results = []
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        query = " ".join(query.split())
+        with self.connection.lock:
+            self.connection.statements.append((query, params))
+        self._results = self.connection.handle(query, params)
+        self.rowcount = len(self._results)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        for params in seq_of_params:
+            self.execute(query, params)
+        return self
+
+    def fetchone(self):
+        return self._results.pop(0) if self._results else None
+
+    def fetchall(self):
+        results, self._results = self._results, []
+        return results
+
+    def close(self):
+        pass
+
+class FakeSnowflakeConnection:
+    """
+    In-memory stand-in for a snowflake.connector connection.
+    Every statement is recorded in `statements`; PUT reads the local file into
+    an in-memory stage so COPY INTO can report how many rows it would load.
+    `results` maps a regex to the rows returned by matching queries.
+    """
+
+    def __init__(self, results=None):
+        self.statements = []
+        self.results = results or {}
+        self.stages = {}
+        self.loaded_rows = 0
+        self.commits = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        return FakeSnowflakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+    def handle(self, query, params):
+        match = re.match(r"PUT 'file://(.+?)' (\S+)", query)
+        if match:
+            path, stage = match.groups()
+            with open(path, "rb") as f:
+                self.stages.setdefault(stage, []).append((path, f.read()))
+            return [(path, stage, "UPLOADED")]
+
+        match = re.match(r"COPY INTO \S+.* FROM (@\S+)", query)
+        if match:
+            rows = sum(self._count_rows(path, data) for path, data in self.stages.pop(match.group(1), []))
+            self.loaded_rows += rows
+            return [("LOADED", rows)]
+
+        if query.startswith("INSERT INTO") and params:
+            columns = re.search(r"\((.*?)\) VALUES", query).group(1).count(",") + 1
+            self.loaded_rows += len(params) // columns
+
+        for pattern, rows in self.results.items():
+            if re.search(pattern, query):
+                return list(rows)
+        return []
+
+    @staticmethod
+    def _count_rows(path, data):
+        if path.endswith(".gz"):
+            data = gzip.decompress(data)
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            return pq.read_metadata(io.BytesIO(data)).num_rows
+        return sum(1 for _ in csv.reader(io.StringIO(data.decode("utf-8"))))
+
+class FakeSqlServerCursor:
+    """pyodbc-style cursor of a FakeSqlServerConnection; CDC rows are generated as they are fetched."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self._rows = iter(())
+
+    def execute(self, query, *params):
+        self.description = None
+        self._rows = iter(self.connection.handle(self, query, params))
+        return self
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def close(self):
+        pass
+
+class FakeSqlServerConnection:
+    """
+    Synthetic stand-in for a pyodbc connection to a CDC-enabled SQL Server.
+    Every table in `tables` has `rows_per_table` changes at LSNs 1..rows_per_table,
+    each with the CDC metadata columns, an "id" primary key cycling over
+    `rows_per_table // updates_per_key` keys, and `width` payload columns of
+    mixed types. Each LSN is its own transaction, committed one second after the
+    previous one. Rows are produced lazily, so large volumes use no memory here.
+    """
+
+    def __init__(self, tables=("dbo.orders",), rows_per_table=100000, width=10, updates_per_key=1):
+        self.tables = list(tables)
+        self.rows_per_table = rows_per_table
+        self.width = width
+        self.key_space = max(rows_per_table // max(updates_per_key, 1), 1)
+        self.queries = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeSqlServerCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    @staticmethod
+    def lsn(value):
+        return value.to_bytes(10, "big")
+
+    def columns(self, commit_time=False):
+        payload = [(f"col_{i}", (str, int, decimal.Decimal, datetime.datetime)[i % 4]) for i in range(self.width)]
+        return [
+            ("__$start_lsn", bytearray), ("__$end_lsn", bytearray), ("__$seqval", bytearray),
+            ("__$operation", int), ("__$update_mask", bytearray), ("id", int),
+        ] + payload + ([("__$commit_time", datetime.datetime)] if commit_time else [])
+
+    def catalog(self):
+        """Rows of the source catalog query: the captured columns of every table with their SQL Server types."""
+        types = {str: ("nvarchar", 128, 0, 0), int: ("int", 4, 10, 0), decimal.Decimal: ("decimal", 9, 18, 2),
+                 datetime.datetime: ("datetime2", 8, 27, 7)}
+        return [
+            (table, table.replace(".", "_"), name) + types[type_code]
+            for table in self.tables
+            for name, type_code in self.columns()
+            if not name.startswith("__$")
+        ]
+
+    def handle(self, cursor, query, params):
+        self.queries += 1
+        if "cdc.ddl_history" in query:
+            return [(len(self.tables), datetime.datetime(2024, 1, 1), 0, None)]
+        if "cdc.captured_columns" in query:
+            return self.catalog()
+        if "sys.tables" in query:
+            return [(table,) for table in self.tables]
+        if "sys.indexes" in query:
+            return [("id",)]
+        if "fn_cdc_get_max_lsn" in query:
+            return [(self.lsn(self.rows_per_table),)]
+        if "fn_cdc_get_min_lsn" in query:
+            return [(self.lsn(1),)]
+        if "fn_cdc_increment_lsn" in query:
+            return [(self.lsn(int.from_bytes(params[0], "big") + 1),)]
+        if "fn_cdc_map_time_to_lsn" in query:
+            return [(self.map_window_end(query, params),)]
+        if "fn_cdc_get_" in query:
+            commit_time = "lsn_time_mapping" in query
+            cursor.description = [
+                (name, type_code, None, None, None, None, True) for name, type_code in self.columns(commit_time)
+            ]
+            return self.changes(int.from_bytes(params[0], "big"), int.from_bytes(params[1], "big"), commit_time)
+        return []
+
+    def map_window_end(self, query, params):
+        """
+        Answer the window cap query: the last LSN committed within `seconds` of the first
+        transaction at or after `from_lsn`. Only the cdc.lsn_time_mapping form is modelled;
+        anything else maps to NULL, as fn_cdc_map_lsn_to_time does for an LSN that starts no transaction.
+        """
+        if "lsn_time_mapping" not in query:
+            return None
+        seconds, from_lsn = params
+        first = int.from_bytes(from_lsn, "big")
+        if first > self.rows_per_table:
+            return None  # No transaction after from_lsn, so MIN(tran_end_time) is NULL
+        return self.lsn(min(first + int(seconds), self.rows_per_table))
+
+    def changes(self, from_lsn, to_lsn, commit_time=False):
+        """Generate change rows; with `commit_time` each row ends with its UTC commit time, taken as now."""
+        base = datetime.datetime(2024, 1, 1)
+        mask = b"\xff"
+        for lsn in range(from_lsn, min(to_lsn, self.rows_per_table) + 1):
+            payload = []
+            for i in range(self.width):
+                kind = i % 4
+                if kind == 0:
+                    payload.append(f"value-{lsn}-{i}")
+                elif kind == 1:
+                    payload.append(lsn * (i + 1))
+                elif kind == 2:
+                    payload.append(decimal.Decimal(lsn) / 100)
+                else:
+                    payload.append(base + datetime.timedelta(seconds=lsn))
+            if commit_time:
+                payload.append(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None))
+            yield (self.lsn(lsn), None, self.lsn(lsn), 2 if lsn <= self.key_space else 4, mask, lsn % self.key_space) + tuple(payload)
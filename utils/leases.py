@@ -0,0 +1,184 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from utils.logger import log_info, log_error
+
+LEASE_TTL_SECONDS = 30
+
+class SqliteLeaseStore:
+    """
+    Time-bound leases kept in a SQLite file, shared by worker processes on one host
+    (or on a shared filesystem with working file locks).
+
+    Any object with the same four methods can be used as a lease store:
+    `acquire(resource, owner, ttl)` takes or extends a lease that is free, expired
+    or already held by `owner`; `renew(resource, owner, ttl)` only extends a lease
+    still held by `owner`; `release(resource, owner)`; and `active(prefix)` returns
+    {resource: owner} for the unexpired leases under `prefix`. Expiry uses wall-clock
+    time, so hosts sharing a store need synchronized clocks.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases (resource TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def acquire(self, resource, owner, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT owner, expires FROM leases WHERE resource = ?", (resource,)).fetchone()
+                acquired = row is None or row[0] == owner or row[1] <= now
+                if acquired:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO leases (resource, owner, expires) VALUES (?, ?, ?)",
+                        (resource, owner, now + ttl)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def renew(self, resource, owner, ttl):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET expires = ? WHERE resource = ? AND owner = ? AND expires > ?",
+                (now + ttl, resource, owner, now)
+            )
+        return cursor.rowcount == 1
+
+    def release(self, resource, owner):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE resource = ? AND owner = ?", (resource, owner))
+
+    def active(self, prefix=""):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT resource, owner FROM leases WHERE resource LIKE ? ESCAPE '\\' AND expires > ?",
+                (prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%", time.time())
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def get_lease_store(path):
+    """Return the lease store for a worker group; a path selects the SQLite file store."""
+    return SqliteLeaseStore(path)
+
+class TableLeases:
+    """
+    Splits tables between the workers of one group (e.g. "publisher") sharing a lease store.
+
+    Each worker holds a membership lease, and `claim(tables)` keeps its fair share,
+    ceil(tables / live workers), of per-table leases: it takes free or expired
+    tables and releases surplus ones so a newly started worker gets work. Tables are
+    tried in an order hashed from the worker id, so assignments stay stable and
+    workers rarely contend for the same table. A heartbeat thread renews every lease
+    each ttl/3; a worker that stops heartbeating loses its tables after `ttl` seconds.
+    """
+
+    def __init__(self, store, group, worker_id, ttl=LEASE_TTL_SECONDS):
+        self.store = store
+        self.group = group
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _member(self):
+        return f"{self.group}/workers/{self.worker_id}"
+
+    def _resource(self, table):
+        return f"{self.group}/tables/{table}"
+
+    def _preference(self, table):
+        return zlib.crc32(f"{self.worker_id}:{table}".encode("utf-8"))
+
+    def heartbeat(self):
+        """Refresh the membership lease and renew held table leases, dropping any that were lost."""
+        self.store.acquire(self._member(), self.worker_id, self.ttl)
+        with self._lock:
+            for table in list(self.held):
+                if not self.store.renew(self._resource(table), self.worker_id, self.ttl):
+                    self.held.discard(table)
+                    log_error(f"{self.group} worker {self.worker_id} lost its lease on {table}")
+
+    def claim(self, tables):
+        """Return the subset of `tables` this worker owns for the next run, in their original order."""
+        try:
+            self.heartbeat()
+            workers = max(len(self.store.active(f"{self.group}/workers/")), 1)
+            share = math.ceil(len(tables) / workers)
+            owners = self.store.active(f"{self.group}/tables/")
+
+            with self._lock:
+                before = set(self.held)
+                for table in self.held - set(tables):
+                    self.store.release(self._resource(table), self.worker_id)
+                    self.held.discard(table)
+
+                surplus = len(self.held) - share
+                for table in sorted(self.held, key=self._preference, reverse=True)[:max(surplus, 0)]:
+                    self.store.release(self._resource(table), self.worker_id)
+                    self.held.discard(table)
+
+                for table in sorted(tables, key=self._preference):
+                    if len(self.held) >= share:
+                        break
+                    if table in self.held or owners.get(self._resource(table), self.worker_id) != self.worker_id:
+                        continue
+                    if self.store.acquire(self._resource(table), self.worker_id, self.ttl):
+                        self.held.add(table)
+
+                if self.held != before:
+                    log_info(
+                        f"{self.group} worker {self.worker_id} owns {len(self.held)} of {len(tables)} tables "
+                        f"({workers} workers): {sorted(self.held)}"
+                    )
+                return [table for table in tables if table in self.held]
+
+        except Exception as e:
+            log_error(f"Lease store error for {self.group} worker {self.worker_id}: {e}")
+            return []  # Without a working store, ownership cannot be confirmed
+
+    def start(self):
+        """Start the background heartbeat thread."""
+        def beat():
+            while not self._stop.wait(self.ttl / 3):
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    log_error(f"Lease heartbeat failed for {self.group} worker {self.worker_id}: {e}")
+
+        self._thread = threading.Thread(target=beat, name=f"{self.group}-leases", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop heartbeating and release every lease, so other workers take over at once."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            for table in self.held:
+                self.store.release(self._resource(table), self.worker_id)
+            self.held.clear()
+        self.store.release(self._member(), self.worker_id)
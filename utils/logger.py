@@ -1,13 +1,143 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+import time
 
-logging.basicConfig(
-    filename="logs/pubsub.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
+LOG_DIR = "logs"
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 
-def log_info(message):
-    logging.info(message)
+def log_file():
+    """
+    Return this process's log file, logs/pubsub-<name>.log. Every process writes its own file, so
+    rotation never renames a file another process has open. The name is CDC_LOG_NAME if set (main.py
+    sets it per worker), else the entry module, e.g. "publisher"; pool worker processes add their pid.
+    """
+    name = os.environ.get("CDC_LOG_NAME") or os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0]
+    name = re.sub(r"[^\w.-]", "_", name).strip("-_.") or "pubsub"
+    if multiprocessing.parent_process() is not None:
+        name = f"{name}-{os.getpid()}"
+    return os.path.join(LOG_DIR, f"pubsub-{name}.log")
 
-def log_error(message):
-    logging.error(message)
+def configure_logging(path=None, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Send log records through an in-memory queue to a rotating file written by a
+    background thread, so callers never wait on file I/O. Returns the listener,
+    which is stopped (and flushed) at interpreter exit.
+    """
+    path = path or log_file()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+class CallSiteLimiter:
+    """
+    Per-call-site sampling and rate limiting.
+    A call site (file and line of the log call) may keep one message in
+    `sample_every` and at most `max_per_minute` messages per minute; the number
+    of messages dropped since the last one is reported with the next one.
+    """
+
+    def __init__(self):
+        self._sites = {}  # site -> [calls, tokens, last refill, suppressed]
+        self._lock = threading.Lock()
+
+    def allow(self, site, sample_every=None, max_per_minute=None):
+        """Return (allowed, suppressed since the last allowed message)."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._sites.setdefault(site, [0, max_per_minute or 0, now, 0])
+            state[0] += 1
+            allowed = not sample_every or (state[0] - 1) % sample_every == 0
+
+            if allowed and max_per_minute:
+                state[1] = min(max_per_minute, state[1] + (now - state[2]) * max_per_minute / 60)
+                state[2] = now
+                allowed = state[1] >= 1
+                if allowed:
+                    state[1] -= 1
+
+            if not allowed:
+                state[3] += 1
+                return False, 0
+            suppressed, state[3] = state[3], 0
+            return True, suppressed
+
+limiter = CallSiteLimiter()
+listener = configure_logging()
+
+def _log(level, message, sample_every, max_per_minute):
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    if sample_every or max_per_minute:
+        frame = sys._getframe(2)
+        allowed, suppressed = limiter.allow((frame.f_code.co_filename, frame.f_lineno), sample_every, max_per_minute)
+        if not allowed:
+            return
+    else:
+        suppressed = 0
+    if callable(message):
+        message = message()  # Built only when it is actually logged
+    if suppressed:
+        message = f"{message} ({suppressed} similar messages suppressed)"
+    logging.log(level, message)
+
+def log_info(message, sample_every=None, max_per_minute=None):
+    """
+    Log at INFO. `message` may be a callable returning the text, so expensive
+    messages are only built when logged. `sample_every` keeps one call in N and
+    `max_per_minute` caps the rate, per call site.
+    """
+    _log(logging.INFO, message, sample_every, max_per_minute)
+
+def log_error(message, sample_every=None, max_per_minute=None):
+    _log(logging.ERROR, message, sample_every, max_per_minute)
+
+class LogSummary:
+    """
+    Aggregates hot-path events into one line, logged when the `with` block ends,
+    e.g. "Loaded blob batches: objects=12, rows=48000 in 3.20s".
+    """
+
+    def __init__(self, title):
+        self.title = title
+        self.counts = {}
+        self.started = time.monotonic()
+
+    def add(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def __enter__(self):
+        return self
+
+    def emit(self):
+        """Log the summary line, if anything was counted."""
+        if self.counts:
+            details = ", ".join(f"{name}={value}" for name, value in self.counts.items())
+            log_info(f"{self.title}: {details} in {time.monotonic() - self.started:.2f}s")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.emit()
+
+def log_summary(title):
+    return LogSummary(title)
@@ -0,0 +1,171 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.logger import log_info
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metric:
+    """A named family of values keyed by label values."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key)) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{escape_label(value)}"' for label, value in pairs) + "}"
+
+class Counter(Metric):
+    """Monotonically increasing total, e.g. rows loaded."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, self._format_labels(key), value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return [{**dict(zip(self.labels, key)), "value": value} for key, value in self._values.items()]
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. queue depth."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets, e.g. stage duration in seconds."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", self._format_labels(key, ("le", f"{bound:g}")), bucket_count))
+                samples.append((f"{self.name}_bucket", self._format_labels(key, ("le", "+Inf")), count))
+                samples.append((f"{self.name}_sum", self._format_labels(key), total))
+                samples.append((f"{self.name}_count", self._format_labels(key), count))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    **dict(zip(self.labels, key)),
+                    "count": count,
+                    "sum": total,
+                    "mean": total / count if count else None,
+                    "buckets": {f"{bound:g}": bucket_count for bound, bucket_count in zip(self.buckets, counts)},
+                }
+                for key, (counts, total, count) in self._values.items()
+            ]
+
+REGISTRY = []
+
+ROWS_EXTRACTED = Counter("cdc_rows_extracted_total", "CDC change rows read from SQL Server", ["table"])
+ROWS_PUBLISHED = Counter("cdc_rows_published_total", "CDC change rows published after compaction", ["table"])
+ROWS_LOADED = Counter("cdc_rows_loaded_total", "CDC change rows merged into Snowflake", ["table"])
+STAGE_SECONDS = Histogram("cdc_stage_duration_seconds", "Duration of one pipeline stage call", ["stage"])
+QUEUE_DEPTH = Gauge("cdc_queue_depth", "Queue items not yet acknowledged", ["consumer"])
+REPLICATION_LAG = Gauge(
+    "cdc_replication_lag_seconds", "Source commit to Snowflake load time of the newest loaded change", ["table"]
+)
+BATCH_BUDGET_ROWS = Gauge("cdc_batch_budget_rows", "Row budget of the next load batch set by the batch sizer", ["table"])
+REPLICATION_LAG_SECONDS = Histogram(
+    "cdc_replication_lag_distribution_seconds", "Source commit to Snowflake load time per loaded batch", ["table"]
+)
+
+def render_prometheus():
+    """Render every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+    return "\n".join(lines) + "\n"
+
+def snapshot():
+    """Return every metric as a JSON-serializable dict."""
+    return {
+        "timestamp": time.time(),
+        "metrics": {metric.name: {"type": metric.kind, "help": metric.help, "values": metric.snapshot()} for metric in REGISTRY},
+    }
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves /metrics (Prometheus text) and /metrics.json (snapshot)."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = render_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise flood stderr
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve the metrics endpoints on a background thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    log_info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics and /metrics.json")
+    return server
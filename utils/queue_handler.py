@@ -48,47 +48,100 @@
 #     """Clear all items from the queue."""
 #     while not cdc_queue.empty():
 #         cdc_queue.get()
-import queue
+import json
 
 from utils.logger import log_info, log_error
-
-# Configure logging
-
-
-# Global queue with logging
-cdc_queue = queue.Queue()
+from utils.segment_log import SegmentLog
+from utils.columnar import ColumnarBatch
+from utils.codec import get_codec, decode_payload
+from utils.metrics import QUEUE_DEPTH
+from config.db_config import DB_CONFIG
+
+QUEUE_DIR = "queue/log"
+DEFAULT_CONSUMER = "subscriber"
+# Payload codec for queued batches: "binary" (type-preserving) or "json"; readers detect either
+QUEUE_CODEC = DB_CONFIG.get("queue_codec", "binary")
+# Batches are appended without keys, so compaction has nothing to drop; enable it only for keyed writers
+QUEUE_COMPACTION = DB_CONFIG.get("queue_compaction", False)
+
+# Durable queue shared by the publisher and subscriber processes on this host
+cdc_queue = SegmentLog(QUEUE_DIR, retention_seconds=7 * 24 * 3600)
+
+def encode_item(data):
+    if isinstance(data, ColumnarBatch):
+        return get_codec(QUEUE_CODEC).encode(data)
+    return json.dumps(data, default=str, separators=(",", ":")).encode("utf-8")
+
+def decode_item(value):
+    """Decode a queue item; columnar payloads come back as a ColumnarBatch."""
+    return decode_payload(value)
 
 def publish_to_queue(data):
     """Publish data to the queue with logging."""
-    cdc_queue.put(data)
-    log_info(f"Published to queue. Current size: {cdc_queue.qsize()}")
-
-def consume_from_queue():
+    offset = cdc_queue.append(encode_item(data))
+    QUEUE_DEPTH.set(get_queue_size(DEFAULT_CONSUMER, end=offset + 1), consumer=DEFAULT_CONSUMER)
+    log_info(f"Published to queue at offset {offset}", max_per_minute=12)
+    return offset
+
+def publish_batch_to_queue(items):
+    """Publish several items with a single append and flush."""
+    offsets = cdc_queue.append_batch([encode_item(item) for item in items])
+    if offsets:
+        QUEUE_DEPTH.set(get_queue_size(DEFAULT_CONSUMER, end=offsets[-1] + 1), consumer=DEFAULT_CONSUMER)
+        log_info(f"Published {len(offsets)} items to queue at offsets {offsets[0]}-{offsets[-1]}")
+    return offsets
+
+def read_from_queue(consumer=DEFAULT_CONSUMER, max_items=10):
+    """Read up to `max_items` (offset, item) pairs without acknowledging them."""
+    records = cdc_queue.read(cdc_queue.committed(consumer), max_items)
+    return [(record.offset, decode_item(record.value)) for record in records]
+
+def ack_queue(consumer, offset):
+    """Acknowledge every item up to and including `offset` for `consumer`."""
+    cdc_queue.commit(consumer, offset + 1)
+    QUEUE_DEPTH.set(get_queue_size(consumer, committed=offset + 1), consumer=consumer)
+
+def consume_from_queue(consumer=DEFAULT_CONSUMER):
     """Consume and log queue items."""
-    if not cdc_queue.empty():
-        item = cdc_queue.get()
-        log_info(f"Consumed from queue. Remaining size: {cdc_queue.qsize()}")
-        return item
-    return None
-
-def print_queue_contents():
-    """Print queue contents for debugging."""
-    # Create a temporary queue to preserve original
-    temp_queue = queue.Queue()
-    contents = []
-
-    while not cdc_queue.empty():
-        item = cdc_queue.get()
-        contents.append(item)
-        temp_queue.put(item)
-
-    # Restore original queue
-    while not temp_queue.empty():
-        cdc_queue.put(temp_queue.get())
+    items = read_from_queue(consumer, max_items=1)
+    if not items:
+        return None
+    offset, item = items[0]
+    ack_queue(consumer, offset)
+    log_info(f"Consumed from queue. Remaining size: {get_queue_size(consumer)}")
+    return item
+
+def get_queue_size(consumer=DEFAULT_CONSUMER, end=None, committed=None):
+    """
+    Get the number of items `consumer` has not yet consumed. Callers that just appended or
+    committed pass the offsets they already know; the log's end otherwise comes from its
+    cached tail, which only parses records added since it was last read.
+    """
+    if end is None:
+        end = cdc_queue.end_offset()
+    if committed is None:
+        committed = cdc_queue.committed(consumer)
+    return max(end - committed, 0)
+
+def compact_queue():
+    """Apply retention to fully consumed or expired segments, then compact keyed records if QUEUE_COMPACTION is set."""
+    try:
+        cdc_queue.enforce_retention()
+        if QUEUE_COMPACTION:
+            cdc_queue.compact()
+    except Exception as e:
+        log_error(f"Queue maintenance error: {e}")
+
+def print_queue_contents(consumer=DEFAULT_CONSUMER):
+    """Print queue contents for debugging without consuming them."""
+    contents = [
+        decode_item(record.value)
+        for record in cdc_queue.read(cdc_queue.committed(consumer), max_records=cdc_queue.end_offset())
+    ]
 
     print("=== Queue Contents ===")
     for i, content in enumerate(contents, 1):
         print(f"Item {i}: {content}")
     print(f"Total Items: {len(contents)}")
 
-    return contents
\ No newline at end of file
+    return contents
@@ -0,0 +1,43 @@
+import threading
+import time
+
+class SchemaRegistry:
+    """
+    In-process cache of target table schemas (lower-cased column name -> type).
+
+    An entry is served until it is older than `ttl_seconds` or the caller asks
+    for a different schema `version` than the one it was stored with, so a
+    table whose schema has not changed costs no metadata queries.
+    """
+
+    def __init__(self, ttl_seconds=300):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # table -> (columns, loaded_at, version)
+        self._lock = threading.Lock()
+
+    def get(self, table, version=None):
+        """Return the cached columns of `table`, or None if missing, expired or stale."""
+        with self._lock:
+            entry = self._entries.get(table)
+            if entry is None:
+                return None
+
+            columns, loaded_at, cached_version = entry
+            expired = self.ttl_seconds is not None and time.monotonic() - loaded_at > self.ttl_seconds
+            if expired or (version is not None and version != cached_version):
+                del self._entries[table]
+                return None
+            return dict(columns)
+
+    def put(self, table, columns, version=None):
+        """Cache the full column set of `table`."""
+        with self._lock:
+            self._entries[table] = (dict(columns), time.monotonic(), version)
+
+    def invalidate(self, table=None):
+        """Drop one table's entry, or every entry when `table` is None."""
+        with self._lock:
+            if table is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table, None)
@@ -0,0 +1,394 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+from utils.logger import log_info, log_error
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# offset, key length, value length, crc32(key + value)
+RECORD_HEADER = struct.Struct("<QIII")
+SEGMENT_SUFFIX = ".log"
+NO_KEY = 0xFFFFFFFF
+
+LogRecord = namedtuple("LogRecord", ["offset", "key", "value"])
+
+class SegmentLog:
+    """
+    Durable, append-only log stored as memory-mapped segment files in a local directory.
+
+    Every record carries its own offset so offsets survive compaction. Consumers
+    track their position independently under `offsets/`, and reads return
+    zero-copy memoryviews into the mapped segments. Appends are serialized across
+    processes with a lock file, so one host can run writers and readers in
+    separate processes.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, retention_seconds=None,
+                 retention_bytes=None, fsync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retention_seconds = retention_seconds
+        self.retention_bytes = retention_bytes
+        self.fsync = fsync
+
+        self._segments_dir = os.path.join(directory, "segments")
+        self._offsets_dir = os.path.join(directory, "offsets")
+        os.makedirs(self._segments_dir, exist_ok=True)
+        os.makedirs(self._offsets_dir, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._maps = {}  # base offset -> (mmap, mapped size)
+        self._tail = None  # (base offset, write position, next offset) of the active segment
+        self._read_hint = None  # (next offset, base offset, position) after the last read
+
+    # ---- segments -------------------------------------------------------
+
+    def _segment_path(self, base):
+        return os.path.join(self._segments_dir, f"{base:020d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self):
+        """Return the base offsets of all segments on disk, oldest first."""
+        return sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self._segments_dir)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _map(self, base):
+        """Return a read-only mapping of a segment, remapping it if the file has grown."""
+        path = self._segment_path(base)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None, 0
+
+        cached = self._maps.get(base)
+        if cached and cached[1] == size:
+            return cached
+        if cached:
+            self._close_map(base)
+        if size == 0:
+            return None, 0
+
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        self._maps[base] = (mapped, size)
+        return mapped, size
+
+    def _close_map(self, base):
+        mapped, _ = self._maps.pop(base, (None, 0))
+        if mapped is None:
+            return
+        try:
+            mapped.close()
+        except BufferError:
+            pass  # A caller still holds a memoryview; the mapping is freed with it
+
+    @staticmethod
+    def _parse(buf, pos, size):
+        """Parse the record at `pos`; returns (offset, key, value, next position) or None if incomplete or corrupt."""
+        if pos + RECORD_HEADER.size > size:
+            return None
+        offset, key_len, value_len, crc = RECORD_HEADER.unpack_from(buf, pos)
+        key_size = 0 if key_len == NO_KEY else key_len
+        start = pos + RECORD_HEADER.size
+        end = start + key_size + value_len
+        if end > size:
+            return None
+
+        view = memoryview(buf)
+        if zlib.crc32(view[start:end]) != crc:
+            return None
+        key = None if key_len == NO_KEY else view[start:start + key_size]
+        return offset, key, view[start + key_size:end], end
+
+    def _scan(self, base, pos=0):
+        """Iterate (offset, key, value, position, next position) for the records of one segment."""
+        mapped, size = self._map(base)
+        while mapped is not None:
+            parsed = self._parse(mapped, pos, size)
+            if parsed is None:
+                return
+            offset, key, value, next_pos = parsed
+            yield offset, key, value, pos, next_pos
+            pos = next_pos
+
+    # ---- writing --------------------------------------------------------
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize appends across threads and processes."""
+        with self._lock:
+            with open(os.path.join(self.directory, ".lock"), "a+b") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                    else:
+                        lock_file.seek(0)
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _advance_tail(self):
+        """
+        Move the cached tail to the last complete record of the active segment, parsing
+        only the bytes added since it was last located. Returns the segment's size on disk.
+        """
+        segments = self._list_segments()
+        if not segments:
+            self._tail = (0, 0, 0)
+            return 0
+
+        base = segments[-1]
+        try:
+            size = os.path.getsize(self._segment_path(base))
+        except FileNotFoundError:
+            size = 0
+        pos, next_offset = 0, base
+        if self._tail and self._tail[0] == base and self._tail[1] <= size:
+            pos, next_offset = self._tail[1], self._tail[2]
+
+        if pos < size:
+            for offset, _, _, _, next_pos in self._scan(base, pos):
+                pos, next_offset = next_pos, offset + 1
+        self._tail = (base, pos, next_offset)
+        return size
+
+    def _sync_tail(self):
+        """Locate the end of the active segment, truncating a torn record left by a crash."""
+        size = self._advance_tail()
+        base, end, _ = self._tail
+        if end < size:
+            log_error(f"Truncating {size - end} bytes of incomplete data from segment {base}")
+            self._close_map(base)
+            with open(self._segment_path(base), "r+b") as f:
+                f.truncate(end)
+
+    def append(self, value, key=None):
+        """Append one record and return its offset."""
+        return self.append_batch([(key, value)])[0]
+
+    def append_batch(self, records):
+        """
+        Append (key, value) pairs (or bare values) with a single write and flush.
+        Returns the offsets assigned to the records.
+        """
+        with self._write_lock():
+            self._sync_tail()
+            base, pos, next_offset = self._tail
+
+            payload = bytearray()
+            offsets = []
+            for record in records:
+                key, value = record if isinstance(record, tuple) else (None, record)
+                key = key.encode() if isinstance(key, str) else key
+                body = (key or b"") + value
+                key_len = NO_KEY if key is None else len(key)
+                payload += RECORD_HEADER.pack(next_offset, key_len, len(value), zlib.crc32(body))
+                payload += body
+                offsets.append(next_offset)
+                next_offset += 1
+
+            if not offsets:
+                return offsets
+
+            if pos and pos + len(payload) > self.segment_bytes:
+                base, pos = offsets[0], 0  # Roll to a new segment
+
+            with open(self._segment_path(base), "ab") as f:
+                f.write(payload)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+            self._tail = (base, pos + len(payload), next_offset)
+            return offsets
+
+    # ---- reading --------------------------------------------------------
+
+    def end_offset(self):
+        """Return the offset the next appended record will receive; only records added since the last call are parsed."""
+        with self._lock:
+            self._advance_tail()
+            return self._tail[2]
+
+    def start_offset(self):
+        """Return the lowest offset still retained in the log, read from the first record header."""
+        with self._lock:
+            for base in self._list_segments():
+                try:
+                    with open(self._segment_path(base), "rb") as f:
+                        header = f.read(RECORD_HEADER.size)
+                except FileNotFoundError:
+                    continue
+                if len(header) == RECORD_HEADER.size:
+                    return RECORD_HEADER.unpack(header)[0]
+            return self.end_offset()
+
+    def read(self, offset, max_records=100):
+        """
+        Read up to `max_records` records starting at `offset`.
+        Keys and values are memoryviews into the mapped segment; copy them
+        with bytes() if they must outlive the next read.
+        """
+        with self._lock:
+            segments = self._list_segments()
+            records = []
+            index = max(
+                (i for i, base in enumerate(segments) if base <= offset),
+                default=0,
+            )
+
+            for base in segments[index:]:
+                pos = 0
+                if self._read_hint and self._read_hint[:2] == (offset, base):
+                    pos = self._read_hint[2]
+
+                for record_offset, key, value, _, next_pos in self._scan(base, pos):
+                    if record_offset < offset:
+                        continue
+                    records.append(LogRecord(record_offset, key, value))
+                    offset = record_offset + 1
+                    self._read_hint = (offset, base, next_pos)
+                    if len(records) >= max_records:
+                        return records
+            return records
+
+    # ---- consumer offsets -----------------------------------------------
+
+    def _offset_path(self, consumer):
+        return os.path.join(self._offsets_dir, f"{consumer}.offset")
+
+    def committed(self, consumer):
+        """Return the next offset `consumer` should read, defaulting to the start of the log."""
+        try:
+            with open(self._offset_path(consumer), "r") as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return self.start_offset()
+
+    def commit(self, consumer, offset):
+        """Atomically record that `consumer` has processed everything before `offset`."""
+        path = self._offset_path(consumer)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def consumers(self):
+        """Return the names of all consumers with committed offsets."""
+        return [name[:-len(".offset")] for name in os.listdir(self._offsets_dir) if name.endswith(".offset")]
+
+    # ---- retention and compaction ---------------------------------------
+
+    def _remove_segment(self, base):
+        self._close_map(base)
+        try:
+            os.remove(self._segment_path(base))
+            return True
+        except OSError as e:
+            log_error(f"Could not remove segment {base}: {e}")
+            return False
+
+    def enforce_retention(self):
+        """
+        Delete closed segments that every consumer has read past, plus any that
+        exceed the configured age or total size limits. Returns the number removed.
+        """
+        with self._write_lock():
+            segments = self._list_segments()
+            closed = segments[:-1]  # Never delete the active segment
+            consumers = self.consumers()
+            min_committed = min((self.committed(c) for c in consumers), default=None)
+
+            sizes = {base: os.path.getsize(self._segment_path(base)) for base in segments}
+            total_bytes = sum(sizes.values())
+            now = time.time()
+            removed = 0
+
+            for i, base in enumerate(closed):
+                consumed = min_committed is not None and segments[i + 1] <= min_committed
+                expired = (
+                    self.retention_seconds is not None
+                    and now - os.path.getmtime(self._segment_path(base)) > self.retention_seconds
+                )
+                oversized = self.retention_bytes is not None and total_bytes > self.retention_bytes
+                if not (consumed or expired or oversized):
+                    break
+
+                if not consumed:
+                    log_error(f"Retention is dropping unconsumed segment {base}")
+                if self._remove_segment(base):
+                    total_bytes -= sizes[base]
+                    removed += 1
+
+            if removed:
+                log_info(f"Retention removed {removed} segment(s) from {self.directory}")
+            return removed
+
+    def compact(self):
+        """
+        Rewrite closed segments keeping only the latest record for each key.
+        Unkeyed records are always kept. Returns the number of records dropped.
+        """
+        with self._write_lock():
+            segments = self._list_segments()
+            latest = {}
+            for base in segments:
+                for offset, key, _, _, _ in self._scan(base):
+                    if key is not None:
+                        latest[bytes(key)] = offset
+
+            dropped = 0
+            for base in segments[:-1]:
+                kept = bytearray()
+                removed = 0
+                mapped, _ = self._map(base)
+                for offset, key, _, pos, next_pos in self._scan(base):
+                    if key is not None and latest[bytes(key)] != offset:
+                        removed += 1
+                        continue
+                    kept += mapped[pos:next_pos]
+
+                if not removed:
+                    continue
+
+                self._close_map(base)
+                path = self._segment_path(base)
+                tmp_path = f"{path}.compact"
+                with open(tmp_path, "wb") as f:
+                    f.write(kept)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+                dropped += removed
+
+            self._read_hint = None
+            if dropped:
+                log_info(f"Compaction dropped {dropped} superseded record(s) from {self.directory}")
+            return dropped
+
+    def close(self):
+        """Release all memory maps held by this instance."""
+        with self._lock:
+            for base in list(self._maps):
+                self._close_map(base)
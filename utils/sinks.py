@@ -0,0 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.blob_store import BlobExistsError, LocalBlobStore, put_batch
+from utils.metrics import STAGE_SECONDS
+from utils.queue_handler import publish_to_queue
+
+class SinkError(Exception):
+    """Raised when one or more sinks did not accept a batch; `failed` maps sink names to their errors."""
+
+    def __init__(self, failed):
+        self.failed = failed
+        super().__init__(", ".join(f"{name}: {error}" for name, error in failed.items()))
+
+class Sink:
+    """
+    A destination for published CDC batches.
+    `write` returns once the batch is durably accepted and raises otherwise. It may see the
+    same batch again after a failed poll, so writes must be safe to repeat.
+    """
+
+    name = "sink"
+    stage = "sink"  # Label of the write's duration in cdc_stage_duration_seconds
+
+    def write(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class QueueSink(Sink):
+    """Appends batches to the local durable queue; a repeated batch is queued again and merged idempotently."""
+
+    name = "queue"
+    stage = "publish_queue"
+
+    def write(self, batch):
+        publish_to_queue(batch)
+
+class BlobSink(Sink):
+    """Uploads each batch as one immutable batch object; an object left by an earlier attempt counts as written."""
+
+    name = "blob"
+    stage = "upload_blob"
+
+    def __init__(self, store, compression="gzip", max_concurrency=4, payload_codec="json"):
+        self.store = store
+        self.compression = compression
+        self.max_concurrency = max_concurrency
+        self.payload_codec = payload_codec
+
+    def write(self, batch):
+        if not len(batch):
+            return
+        try:
+            put_batch(self.store, batch, self.compression, self.max_concurrency, self.payload_codec)
+        except BlobExistsError:
+            pass  # Object names are derived from the batch's contents, so this batch is already stored
+
+class SpoolSink(BlobSink):
+    """Writes batch objects to a local directory in the blob layout, so the subscriber can load them with `local_path`."""
+
+    name = "spool"
+    stage = "spool"
+
+    def __init__(self, path, compression="gzip", payload_codec="json"):
+        super().__init__(LocalBlobStore(path), compression, 1, payload_codec)
+
+SINKS = {}
+
+def register_sink(name, factory):
+    """Make a sink available by `name`; `factory()` builds it when a publisher first needs it."""
+    SINKS[name] = factory
+    return factory
+
+def get_sink(name):
+    try:
+        return SINKS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown sink '{name}'; expected one of {sorted(SINKS)}")
+
+class SinkFanout:
+    """
+    Writes every batch to all of its sinks concurrently and returns once each has
+    acknowledged it, so a batch costs the time of the slowest sink rather than the sum.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self._executor = ThreadPoolExecutor(max_workers=len(sinks), thread_name_prefix="cdc-sink") if len(sinks) > 1 else None
+
+    def _write(self, sink, batch):
+        with STAGE_SECONDS.time(stage=sink.stage):
+            sink.write(batch)
+
+    def write(self, batch):
+        """Write one batch to every sink; raises SinkError naming the sinks that failed."""
+        if self._executor is None:
+            outcomes = []
+            for sink in self.sinks:
+                try:
+                    self._write(sink, batch)
+                    outcomes.append((sink.name, None))
+                except Exception as e:
+                    outcomes.append((sink.name, e))
+        else:
+            futures = [(sink.name, self._executor.submit(self._write, sink, batch)) for sink in self.sinks]
+            outcomes = [(name, future.exception()) for name, future in futures]
+        failed = {name: error for name, error in outcomes if error is not None}
+        if failed:
+            raise SinkError(failed)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+import zlib
+
+from utils.logger import log_info
+
+# Changes whenever a capture instance is created or dropped, or DDL runs on a tracked table
+CATALOG_VERSION_QUERY = """
+SELECT
+    (SELECT COUNT(*) FROM cdc.change_tables),
+    (SELECT MAX(create_date) FROM cdc.change_tables),
+    (SELECT COUNT(*) FROM cdc.ddl_history),
+    (SELECT MAX(ddl_time) FROM cdc.ddl_history)
+"""
+
+# Captured columns of every capture instance with their current source types; a column dropped
+# from the source since the instance was created keeps the type name recorded at capture time
+CATALOG_QUERY = """
+SELECT s.name + '.' + t.name, ct.capture_instance, cc.column_name,
+       COALESCE(TYPE_NAME(c.system_type_id), cc.column_type), c.max_length, c.precision, c.scale
+FROM cdc.change_tables ct
+INNER JOIN sys.tables t ON t.object_id = ct.source_object_id
+INNER JOIN sys.schemas s ON s.schema_id = t.schema_id
+INNER JOIN cdc.captured_columns cc ON cc.object_id = ct.object_id
+LEFT JOIN sys.columns c ON c.object_id = ct.source_object_id AND c.column_id = cc.column_id AND c.name = cc.column_name
+ORDER BY ct.create_date, ct.capture_instance, cc.column_ordinal
+"""
+
+def format_sql_type(type_name, max_length=None, precision=None, scale=None):
+    """Spell a SQL Server column type with its length, precision or scale, e.g. "decimal(18,4)" or "nvarchar(max)"."""
+    if max_length is None:
+        return type_name
+    if type_name in ("decimal", "numeric"):
+        return f"{type_name}({precision},{scale})"
+    if type_name in ("char", "varchar", "binary", "varbinary"):
+        return f"{type_name}({'max' if max_length == -1 else max_length})"
+    if type_name in ("nchar", "nvarchar"):
+        return f"{type_name}({'max' if max_length == -1 else max_length // 2})"
+    if type_name in ("datetime2", "datetimeoffset", "time"):
+        return f"{type_name}({scale})"
+    return type_name
+
+class SourceCatalog:
+    """
+    Cached catalog of the source's CDC capture instances.
+
+    For every tracked table it keeps the newest capture instance, its captured
+    columns with their exact SQL Server types, and a version that changes only
+    when those types do. The catalog is reloaded only when cdc.change_tables or
+    cdc.ddl_history changes, and that check runs at most every `check_seconds`.
+    """
+
+    def __init__(self, check_seconds=30):
+        self.check_seconds = check_seconds
+        self._entries = {}  # table -> {"capture_instance", "columns": {name: type}, "version"}
+        self._version = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, cursor, force=False):
+        """Reload the catalog if the source's capture instances or DDL history changed; returns True if reloaded."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked_at is not None and now - self._checked_at < self.check_seconds:
+                return False
+
+            cursor.execute(CATALOG_VERSION_QUERY)
+            version = tuple(str(value) for value in cursor.fetchone())
+            self._checked_at = now
+            if version == self._version:
+                return False
+
+            cursor.execute(CATALOG_QUERY)
+            entries = {}
+            for table, capture_instance, column, type_name, max_length, precision, scale in cursor.fetchall():
+                entry = entries.get(table)
+                if entry is None or entry["capture_instance"] != capture_instance:
+                    # Rows are ordered by creation, so a newer capture instance replaces an older one
+                    entry = entries[table] = {"capture_instance": capture_instance, "columns": {}}
+                entry["columns"][column] = format_sql_type(type_name, max_length, precision, scale)
+
+            for entry in entries.values():
+                signature = json.dumps([entry["capture_instance"], entry["columns"]]).encode("utf-8")
+                entry["version"] = f"{entry['capture_instance']}:{zlib.crc32(signature):08x}"
+
+            self._entries = entries
+            self._version = version
+            log_info(f"Loaded source catalog: {len(entries)} CDC-enabled tables")
+            return True
+
+    def tables(self):
+        """Return the CDC-enabled source tables as "schema.table" names."""
+        return sorted(self._entries)
+
+    def get(self, table):
+        """Return a table's catalog entry, or None if it is not tracked."""
+        return self._entries.get(table)